@@ -1,11 +1,30 @@
 """This module contains base class that encapsulates all external APIs processing."""
 
+import asyncio
 import traceback
-import importlib
-import requests
-
-from config import logging, HTTP_TIMEOUT
-from models import XRate, peewee_datetime, ApiLog, ErrorLog, LatestUpdate
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from config import logging, HTTP_TIMEOUT, REFRESH_WORKERS, REFRESH_WORKERS_PER_MODULE, RATES_UPDATE_INTERVAL, \
+    RATES_MIN_UPDATE_INTERVAL, RATES_MAX_UPDATE_INTERVAL, HEDGE_PERCENTILE, HEDGE_DELAY, RATES_FRESH_TTL, \
+    RATES_EXPIRE_TTL, AUTO_CREATE_RATES, ASYNC_REFRESH
+from models import peewee_datetime, XRate, ApiLog, ErrorLog, save_rates, db_connection
+from api.sessions import sessions, async_sessions
+from api.registry import registry
+from api.log_sink import log_sink
+from api.schedule import schedule
+from api.resilience import CircuitBreaker, LatencyTracker, hedged, hedged_async
+from api.event_loop import event_loop
+
+# The cache of external APIs responses that is shared by all the updates of the current refresh cycle
+_cycle_cache = ContextVar("cycle_cache", default=None)
+
+# The pairs which are being refreshed on demand => the events set when their refreshes are finished
+_refreshing = {}
+_refreshing_lock = threading.Lock()
 
 
 def update_rate(from_currency, to_currency):
@@ -17,14 +36,15 @@ def update_rate(from_currency, to_currency):
     The main algorithm:
     1. Receive from the calling code exactly two parameters - the international digital code of the currency
     to be exchanged from and the code of the currency to be exchanged to;
-    2. Find the corresponding record in the database, based on the combination of received codes;
-    3. Get from the record the name of the module responsible for obtaining this exchange rate;
-    4. Import this module dynamically;
-    5. Create an instance of the API class implemented in imported module (which encapsulates all
-    the auxiliary functions for making a request to the correspondent bank API and response processing);
-    6. Call the update_rate method of this class on the instance of this class, the result of which
+    2. Find in the handlers registry the DB entity, based on the combination of received codes, and the instance
+    of the API class (which encapsulates all the auxiliary functions for making a request to the correspondent
+    bank API and response processing) implemented in the module responsible for obtaining this exchange rate;
+    3. Call the update_rate method of this class on the instance of this class, the result of which
     will be the update of the exchange rate of the specified currencies in the system.
 
+    Handler modules are imported and their API classes are instantiated only once, the registry keeps the
+    instances and the routing table in memory, so finding the handler is a simple dict lookup.
+
     Thus, we removed from the calling code the need to know which module to import and manually import each module
     for each combination of currencies (if the system grows further, it will contain hundreds of modules, it will be
     easy to make a mistake and try to update the currencies rate using the wrong module for them) and call on the
@@ -38,17 +58,402 @@ def update_rate(from_currency, to_currency):
         to_currency (int): the international digital code of the currency to be exchanged to.
 
     """
-    # Find corresponding record in the database
-    xrate = XRate.select().where(XRate.from_currency == from_currency,
-                                 XRate.to_currency == to_currency).first()
+    # Find the handler responsible for the rate and the corresponding DB entity
+    handler, xrate = registry.resolve(from_currency, to_currency)
+    handler.update_rate(xrate)
+
+
+def update_rates(xrates=None, create=None):
+    """Update many exchange rates at once, running the updates of different pairs concurrently.
+
+    Each pair is fetched in a pool of worker threads, so the whole refresh takes about as long as the slowest
+    external API instead of the sum of all of them. The number of simultaneous requests to the same handler module
+    is bounded separately, to avoid hammering a single external API with all the pairs it is responsible for.
+    When all the rates are fetched, they are stored in the DB at once in a single transaction.
+
+    Bulk handlers provide all their rates with one request, so the pairs they provide but the DB doesn't
+    contain yet can be created along with the update, without any additional requests.
+
+    Args:
+        xrates (iterable): (optional) XRate entities to update, all the rates known to the registry by default.
+        create (bool): (optional) create the new pairs provided by the bulk handlers of the updated rates,
+            by default it is AUTO_CREATE_RATES on a full refresh and False otherwise.
+
+    Returns:
+        dict: The outcome of every pair, (from_currency, to_currency) => None if the update succeeded
+            or the exception that occurred otherwise.
+
+    """
+    if create is None:
+        create = AUTO_CREATE_RATES and xrates is None
+    if xrates is None:
+        xrates = registry.xrates()
+    xrates = list(xrates)
+
+    # One semaphore per handler module bounds the concurrency towards every particular external API
+    semaphores = {module: threading.BoundedSemaphore(REFRESH_WORKERS_PER_MODULE)
+                  for module in {xrate.module for xrate in xrates}}
+
+    def fetch(xrate):
+        with semaphores[xrate.module]:
+            return _fetch_rate(xrate)
+
+    outcomes = {}
+    with refresh_cycle(create), ThreadPoolExecutor(max_workers=max(1, min(REFRESH_WORKERS, len(xrates)))) as executor:
+        # Every update runs in a copy of the current context to see the cache of this refresh cycle
+        futures = [(xrate, executor.submit(copy_context().run, fetch, xrate)) for xrate in xrates]
+        for xrate, future in futures:
+            outcomes[(xrate.from_currency, xrate.to_currency)] = future.exception()
+        # The bulk handlers' rates are already fetched in this cycle, so new pairs cost no requests
+        created = _new_rates(xrates) if create else []
+
+    fetched = [(xrate, future.result()) for xrate, future in futures if future.exception() is None]
+    return _store_rates(fetched, created, outcomes)
+
+
+async def update_rates_async(xrates=None, create=None):
+    """Update many exchange rates at once on the running event loop, the asyncio variant of update_rates.
+
+    The pairs of async handlers (_AsyncApi) are fetched by coroutines of the loop, so hundreds of pairs don't need
+    a thread per request, and the number of simultaneous requests to every external API host is bounded by the pooled
+    async session. The pairs of sync handlers are fetched in worker threads, bounded per handler module like
+    in update_rates. The new pairs are looked for and all the rates are stored in a worker thread as well,
+    so the loop is never blocked by the DB.
+
+    Args:
+        xrates (iterable): (optional) XRate entities to update, all the rates known to the registry by default.
+        create (bool): (optional) create the new pairs provided by the bulk handlers of the updated rates,
+            like in update_rates.
+
+    Returns:
+        dict: The outcome of every pair, like update_rates returns.
+
+    """
+    if create is None:
+        create = AUTO_CREATE_RATES and xrates is None
+    if xrates is None:
+        xrates = registry.xrates()
+    xrates = list(xrates)
+
+    semaphores = {module: asyncio.Semaphore(REFRESH_WORKERS_PER_MODULE)
+                  for module in {xrate.module for xrate in xrates}}
+
+    def new_rates():
+        with db_connection():
+            return _new_rates(xrates)
+
+    async def fetch(xrate):
+        handler = registry.handler(xrate.module)
+        if isinstance(handler, _AsyncApi):
+            return await handler.fetch_rate_async(xrate)
+        async with semaphores[xrate.module]:
+            return await asyncio.to_thread(handler.fetch_rate, xrate)
+
+    with refresh_cycle(create):
+        # Tasks and worker threads run in copies of the current context, so they see the cache of this refresh cycle
+        results = await asyncio.gather(*(fetch(xrate) for xrate in xrates), return_exceptions=True)
+        created = await asyncio.to_thread(new_rates) if create else []
+
+    outcomes = {(xrate.from_currency, xrate.to_currency): result if isinstance(result, Exception) else None
+                for xrate, result in zip(xrates, results)}
+    fetched = [(xrate, result) for xrate, result in zip(xrates, results) if not isinstance(result, Exception)]
+
+    def store():
+        with db_connection():
+            return _store_rates(fetched, created, outcomes)
+
+    return await asyncio.to_thread(store)
+
+
+def _store_rates(fetched, created, outcomes):
+    """Store all the successfully fetched rates and the new pairs in one go.
+
+    Args:
+        fetched (list): (XRate entity, its new rate) tuples.
+        created (list): new XRate entities with fetched rates.
+        outcomes (dict): the outcomes of the fetched pairs, the outcomes of the new pairs and storing errors are added.
+
+    Returns:
+        dict: The outcomes.
+
+    """
+    time = peewee_datetime.datetime.now()
+    for xrate, rate in fetched:
+        xrate.rate = rate
+        xrate.updated = time
+    for xrate in created:
+        xrate.updated = time
+        outcomes[(xrate.from_currency, xrate.to_currency)] = None
+
+    xrates = [xrate for xrate, _ in fetched] + created
+    try:
+        save_rates(xrates)
+    except Exception as ex:
+        for xrate in xrates:
+            outcomes[(xrate.from_currency, xrate.to_currency)] = ex
+    else:
+        if created:
+            registry.reload_routes()
+
+    return outcomes
+
+
+def _new_rates(xrates):
+    """Find the pairs provided by the bulk handlers of the given rates, which are not stored in the DB yet.
+
+    Args:
+        xrates (list): the updated XRate entities, the bulk handlers of their modules are asked for the new pairs.
 
-    # Get the name of particular handler responsible for processing of rate updating
-    # and import this module dynamically
-    module = importlib.import_module(f"api.{xrate.module}")
+    Returns:
+        list: New XRate entities with fetched rates, not saved yet.
 
-    # Crate an instance of the API class, which has to be realized in the imported module
-    # and call the update_rate method of this class with founded database record as a parameter
-    module.Api().update_rate(xrate)
+    """
+    # The updated rates could be only a part of the stored ones (f.e. the due ones), so the stored pairs are read
+    known = {(xrate.from_currency, xrate.to_currency)
+             for xrate in XRate.select(XRate.from_currency, XRate.to_currency)}
+    created = []
+    for module in sorted({xrate.module for xrate in xrates}):
+        handler = registry.handler(module)
+        if not handler.bulk:
+            continue
+        try:
+            rates = handler.fetch_rates()
+        except Exception:
+            # The error is already an outcome of the handler's known pairs
+            continue
+        for (from_currency, to_currency), rate in rates.items():
+            if (from_currency, to_currency) not in known:
+                known.add((from_currency, to_currency))
+                created.append(XRate(from_currency=from_currency, to_currency=to_currency, rate=rate, module=module))
+    return created
+
+
+def update_due_rates():
+    """Update the exchange rates which are due according to the refresh schedule and adapt their intervals.
+
+    Returns:
+        dict: The outcome of every updated pair, like update_rates returns, empty if nothing was due.
+
+    """
+    now = peewee_datetime.datetime.now()
+    xrates = schedule.due(now)
+    if not xrates:
+        return {}
+
+    previous_rates = {(xrate.from_currency, xrate.to_currency): xrate.rate for xrate in xrates}
+    # All the due rates are refreshed on the event loop of the process, or by worker threads
+    # The new pairs are created along with the scheduled refreshes of the bulk handlers' rates, if it is configured
+    if ASYNC_REFRESH:
+        outcomes = event_loop.run(update_rates_async(xrates, create=AUTO_CREATE_RATES))
+    else:
+        outcomes = update_rates(xrates, create=AUTO_CREATE_RATES)
+    for xrate in xrates:
+        pair = (xrate.from_currency, xrate.to_currency)
+        schedule.record(xrate, previous_rates[pair], outcomes[pair], now)
+    return outcomes
+
+
+def freshness(xrate, now=None):
+    """Find out how fresh the rate is, by its age and the freshness TTLs of its handler.
+
+    Args:
+        xrate (XRate): the rate, an XRate entity or a rates snapshot item.
+        now (datetime): (optional) the current date and time.
+
+    Returns:
+        str: "fresh", "stale" (it is still served, but has to be refreshed) or "expired".
+
+    """
+    if registry.known(xrate.module):
+        handler = registry.handler(xrate.module)
+        fresh_ttl, expire_ttl = handler.fresh_ttl, handler.expire_ttl
+    else:
+        # The rates without a handler (f.e. the test ones) are never refreshed, they just age by the default TTLs
+        fresh_ttl, expire_ttl = RATES_FRESH_TTL, RATES_EXPIRE_TTL
+    age = ((now or peewee_datetime.datetime.now()) - xrate.updated).total_seconds()
+    if age <= fresh_ttl:
+        return "fresh"
+    return "stale" if age <= expire_ttl else "expired"
+
+
+def refresh(pairs):
+    """Update the rates of the pairs at once, waiting for the result.
+
+    Concurrent refreshes are coalesced: the pairs which are being refreshed already (by another request or
+    in the background) are not fetched again, their refresh in flight is waited for instead (up to HTTP_TIMEOUT).
+
+    Args:
+        pairs (iterable): (from_currency, to_currency) tuples.
+
+    Returns:
+        dict: The outcome of every pair refreshed by this call, like update_rates returns.
+
+    """
+    claimed, in_flight = _claim(pairs)
+    outcomes = _refresh_claimed(claimed)
+    for finished in in_flight:
+        finished.wait(HTTP_TIMEOUT)
+    return outcomes
+
+
+def revalidate(pairs):
+    """Update the rates of the pairs in a background thread, the pairs which are being updated already are skipped.
+
+    The old values are served until the update is stored (stale-while-revalidate).
+
+    Args:
+        pairs (iterable): (from_currency, to_currency) tuples.
+
+    Returns:
+        Thread: The thread of the update, None if all the pairs are being updated already.
+
+    """
+    pairs, _ = _claim(pairs)
+    if not pairs:
+        return None
+
+    def run():
+        try:
+            with db_connection():
+                outcomes = _refresh_claimed(pairs)
+            for (from_currency, to_currency), ex in outcomes.items():
+                if ex is not None:
+                    logging.getLogger("Api").error(f"Failed to revalidate {from_currency}=>{to_currency}", exc_info=ex)
+        except Exception:
+            logging.getLogger("Api").exception("Error during revalidation")
+
+    thread = threading.Thread(target=run, name="Revalidation", daemon=True)
+    thread.start()
+    return thread
+
+
+def _claim(pairs):
+    """Mark the pairs which are not being refreshed yet as refreshed by the caller.
+
+    Returns:
+        tuple: The claimed pairs, and the events of the refreshes in flight of the other pairs.
+
+    """
+    with _refreshing_lock:
+        in_flight = {_refreshing[pair] for pair in pairs if pair in _refreshing}
+        claimed = [pair for pair in dict.fromkeys(pairs) if pair not in _refreshing]
+        for pair in claimed:
+            _refreshing[pair] = threading.Event()
+    return claimed, in_flight
+
+
+def _refresh_claimed(pairs):
+    """Update the rates of the claimed pairs and release them, waking up the ones who wait for them."""
+    try:
+        return update_rates([registry.resolve(*pair)[1] for pair in pairs]) if pairs else {}
+    finally:
+        with _refreshing_lock:
+            for pair in pairs:
+                _refreshing.pop(pair).set()
+
+
+@contextmanager
+def refresh_cycle(create=False):
+    """A context manager that shares the external APIs responses between all the updates made inside it.
+
+    During a refresh cycle every distinct request (method, URL, data and headers) is sent only once and its
+    response (as well as the parsed response data) is reused by all the handlers that need it. E.g. PrivatBank
+    returns USD and BTC rates in one document, so it is downloaded once for both pairs.
+
+    Args:
+        create (bool): (optional) whether the new pairs provided by bulk handlers are created in this cycle.
+
+    """
+    token = _cycle_cache.set(_CycleCache(create))
+    try:
+        yield
+    finally:
+        _cycle_cache.reset(token)
+
+
+class _CycleCache:
+    """A thread safe storage of values shared within one refresh cycle.
+
+    Concurrent requests for the same key wait for the first one to load the value instead of loading it again,
+    whether they are made by threads or by coroutines. Errors are stored as well, so a failed external API
+    is called only once per cycle.
+
+    Attributes:
+        create (bool): whether the new pairs provided by bulk handlers are created in this cycle.
+
+    """
+
+    def __init__(self, create=False):
+        self.create = create
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, key, load):
+        future, owner = self._future(key)
+        if owner:
+            try:
+                future.set_result(load())
+            except BaseException as ex:
+                future.set_exception(ex)
+        return future.result()
+
+    async def get_async(self, key, load):
+        future, owner = self._future(key)
+        if owner:
+            try:
+                future.set_result(await load())
+            except BaseException as ex:
+                future.set_exception(ex)
+        return await asyncio.wrap_future(future)
+
+    def _future(self, key):
+        # The first one who asks for the key loads the value, the others wait for its future
+        with self._lock:
+            if key in self._futures:
+                return self._futures[key], False
+            future = self._futures[key] = Future()
+            return future, True
+
+
+def creating_rates():
+    """Return whether the current refresh cycle creates the new pairs provided by bulk handlers.
+
+    Bulk handlers use it to decide whether they need all the rates of their responses or only the stored ones.
+
+    """
+    cache = _cycle_cache.get()
+    return cache is not None and cache.create
+
+
+def _shared(key, load):
+    """Return the value loaded by the load function, shared within the current refresh cycle if there is one."""
+    cache = _cycle_cache.get()
+    if cache is None:
+        return load()
+    return cache.get(key, load)
+
+
+async def _shared_async(key, load):
+    """The same as _shared, but the load function is a coroutine function."""
+    cache = _cycle_cache.get()
+    if cache is None:
+        return await load()
+    return await cache.get_async(key, load)
+
+
+def _fetch_rate(xrate):
+    """Obtain the new value of the exchange rate using the handler module specified in the DB entity.
+
+    Args:
+        xrate (XRate): the corresponding DB entity.
+
+    Returns:
+        float: The new value of the exchange rate.
+
+    """
+    # Get the instance of particular handler responsible for processing of rate updating
+    # and call the fetch_rate method of this class with the database record as a parameter
+    return registry.handler(xrate.module).fetch_rate(xrate)
 
 
 class _Api:
@@ -59,12 +464,34 @@ class _Api:
     2. Move all identical actions of API handlers to the base class, avoiding code duplication
     3. Unify logging and move the bulk of it to the base class, thereby again avoiding code duplication.
 
+    Attributes:
+        sessions (SessionManager): the pooled keep-alive HTTP session shared by all the handlers.
+        refresh_interval (int): the base interval in seconds the handler's rates are refreshed with,
+            it can be overridden by a particular XRate entity.
+        min_refresh_interval (int): the shortest interval in seconds the refresh schedule can adapt to.
+        max_refresh_interval (int): the longest interval in seconds the refresh schedule can adapt to.
+        fresh_ttl (int): the age in seconds up to which the handler's rates are fresh.
+        expire_ttl (int): the age in seconds up to which the handler's rates are stale, they are expired after it.
+        mirrors (dict): URLs of the external API => URLs of its mirrors that return the same responses.
+        breaker (CircuitBreaker): the circuit breaker of the external API, shared by all the handler's requests.
+        latency (LatencyTracker): the latest durations of the handler's requests.
+
     """
 
+    sessions = sessions
+    refresh_interval = RATES_UPDATE_INTERVAL
+    min_refresh_interval = RATES_MIN_UPDATE_INTERVAL
+    max_refresh_interval = RATES_MAX_UPDATE_INTERVAL
+    fresh_ttl = RATES_FRESH_TTL
+    expire_ttl = RATES_EXPIRE_TTL
+    mirrors = {}
+
     def __init__(self, logger_name):
-        # Initialize corresponding logger (should be called from derived classes constructors)
-        self.log = logging.getLogger("Api")
-        self.log.name = logger_name
+        # Initialize corresponding logger (should be called from derived classes constructors),
+        # it is a child of the common "Api" logger and uses its handlers
+        self.log = logging.getLogger(f"Api.{logger_name}")
+        self.breaker = CircuitBreaker(logger_name)
+        self.latency = LatencyTracker()
 
     def update_rate(self, xrate):
         """This method encapsulates all operations for updating particular exchange rate in the system.
@@ -84,25 +511,76 @@ class _Api:
         5. It will not be found in derived class, so it will be called from the base class (_API).
         6. Inside the _send_request method will be called the auxiliary method _send.
         7. It will not be found in derived class, so it will be called from the base class (_API).
+        8. The new rate is stored in the DB together with the time of the latest update.
 
         Args:
             xrate (XRate): the corresponding DB entity.
 
+        """
+        xrate.rate = self.fetch_rate(xrate)
+        xrate.updated = peewee_datetime.datetime.now()
+        save_rates([xrate])
+
+        self.log.info("Finished update for: %s" % xrate)
+
+    def fetch_rate(self, xrate):
+        """Obtain the new value of the exchange rate without storing it in the DB.
+
+        It is used by the update_rate method of this class, as well as by the api.update_rates function
+        which fetches many rates concurrently and then stores them all at once.
+
+        Args:
+            xrate (XRate): the corresponding DB entity.
+
+        Returns:
+            float: The new value of the exchange rate.
+
         """
         self.log.info("Started update for: %s" % xrate)
         self.log.debug("Rate before: %s", xrate)
 
-        xrate.rate = self._update_rate(xrate)
-        time = peewee_datetime.datetime.now()
-        xrate.updated = time
-        xrate.save()
+        if self.bulk:
+            # Bulk handlers take the rate from all the rates provided by the external API
+            rates = self.fetch_rates()
+            if (xrate.from_currency, xrate.to_currency) not in rates:
+                raise ValueError(f"Rate {xrate.from_currency}=>{xrate.to_currency} is not provided by {self.module}")
+            rate = rates[(xrate.from_currency, xrate.to_currency)]
+        else:
+            rate = self._update_rate(xrate)
 
-        latest_update = LatestUpdate.get(id=1)
-        latest_update.datetime = time
-        latest_update.save()
+        self.log.debug("Rate fetched: %s", rate)
+        return rate
 
-        self.log.debug("Rate after: %s", xrate)
-        self.log.info("Finished update for: %s" % xrate)
+    @property
+    def module(self):
+        """str: The name of the handler module in the api package."""
+        return type(self).__module__.rsplit(".", 1)[-1]
+
+    @property
+    def bulk(self):
+        """bool: Whether the handler provides all its rates at once (implements _fetch_rates)."""
+        return type(self)._fetch_rates is not _Api._fetch_rates
+
+    def fetch_rates(self):
+        """Obtain all the exchange rates provided by the external API of a bulk handler.
+
+        The rates are shared within a refresh cycle, so all the handler's pairs cost one request and one parsing.
+
+        Returns:
+            dict: (from_currency, to_currency) => the exchange rate.
+
+        """
+        return _shared(("rates", self.module), self._fetch_rates)
+
+    def _fetch_rates(self):
+        """This method can be implemented in handlers whose external API returns many rates in one response,
+        instead of _update_rate. It is responsible for obtaining all of them at once.
+
+        Returns:
+            dict: (from_currency, to_currency) => the exchange rate.
+
+        """
+        raise NotImplementedError("_fetch_rates")
 
     def _update_rate(self, xrate):
         """This abstract method have to be implemented in each derived classes-handlers where it will be
@@ -121,6 +599,7 @@ class _Api:
 
         It is necessary because it allows to avoid code duplications since in general the requesting
         process is absolutely similar for all data sources as well as it's logging and error processing.
+        Inside a refresh cycle the same request is sent only once and its response is shared.
 
         Args:
             method (str): HTTP method's name.
@@ -129,21 +608,83 @@ class _Api:
             data (any): (optional) additional data for the request
 
         """
-        log = ApiLog(request_url=str(url).split('?')[0], request_data=data, request_method=method,
-                     request_headers=headers)
+        return _shared(self._request_key("response", url, method, data, headers),
+                       lambda: self._send_guarded_request(url, method, data, headers))
+
+    def _send_json_request(self, url, method, data=None, headers=None):
+        """The same as _send_request, but returns the parsed response JSON, which is also shared in a refresh cycle.
+
+        Returns:
+            any: The parsed JSON response of the external API.
+
+        """
+        return _shared(self._request_key("json", url, method, data, headers),
+                       lambda: self._send_request(url, method, data, headers).json())
+
+    @staticmethod
+    def _request_key(kind, url, method, data, headers):
+        """Build a hashable key that identifies the request (and the kind of its result) in a refresh cycle cache."""
+        return kind, method.lower(), url, data, tuple(sorted(headers.items())) if headers else None
+
+    def _send_guarded_request(self, url, method, data=None, headers=None):
+        """Send the request through the handler's circuit breaker, hedged with the mirrors of the URL if there are any.
+
+        While the breaker is open the request fails at once with CircuitOpenError, so a dead external API
+        doesn't hold a refresh cycle for the whole HTTP timeout. A request to a URL with mirrors is repeated
+        on the next mirror when it takes longer than usual (the percentile of the latest requests durations).
+
+        """
+        self.breaker.allow()
+        started = time.monotonic()
+        try:
+            urls = [url, *self.mirrors.get(url, ())]
+            if len(urls) == 1:
+                response = self._send_logged_request(url, method, data, headers)
+            else:
+                delay = self.latency.percentile(HEDGE_PERCENTILE) or HEDGE_DELAY
+                response = hedged([lambda url=url: self._send_logged_request(url, method, data, headers)
+                                   for url in urls], delay)
+        except BaseException as ex:
+            # An interrupted call (f.e. cancelled or stopped by a signal) is failed too, so a trial call is never lost
+            self.breaker.record(time.monotonic() - started, ex)
+            raise
+
+        elapsed = time.monotonic() - started
+        self.latency.add(elapsed)
+        self.breaker.record(elapsed)
+        return response
+
+    def _send_logged_request(self, url, method, data=None, headers=None):
+        """Actually send the request, writing it to the external API calls log and errors to the errors log.
+
+        The logs are written by the background log sink, so the request never waits for the logs DB.
+
+        """
+        log = self._request_log(url, method, data, headers)
         try:
             response = self._send(method=method, url=url, headers=headers, data=data)
-            log.response_text = response.text
+            log["response_text"] = response.text
             return response
         except Exception as ex:
-            self.log.exception("Error during request sending")
-            log.error = str(ex)
-            ErrorLog.create(request_data=data, request_url=str(url).split('?')[0], request_method=method,
-                            error=str(ex), traceback=traceback.format_exc(chain=False))
+            self._log_error(log, ex)
             raise
         finally:
-            log.finished = peewee_datetime.datetime.now()
-            log.save()
+            log["finished"] = peewee_datetime.datetime.now()
+            log_sink.write(ApiLog, **log)
+
+    @staticmethod
+    def _request_log(url, method, data, headers):
+        """Start the external API call log entity of the request."""
+        return dict(request_url=str(url).split('?')[0], request_data=data, request_method=method,
+                    request_headers=headers, response_text=None, error=None, created=peewee_datetime.datetime.now())
+
+    def _log_error(self, log, ex):
+        """Write the error of the request to the errors log, it has to be called while the error is being handled."""
+        self.log.exception("Error during request sending")
+        log["error"] = str(ex)
+        log_sink.write(ErrorLog, request_data=log["request_data"], request_url=log["request_url"],
+                       request_method=log["request_method"], error=str(ex), traceback=traceback.format_exc(chain=False),
+                       created=peewee_datetime.datetime.now())
 
     def _send(self, url, method, data=None, headers=None):
         """This auxiliary method is responsible for actual sending the request.
@@ -160,5 +701,142 @@ class _Api:
             allow_redirection (bool): (optional) allow redirection is better to be true
 
         """
-        return requests.request(method=method, url=url, headers=headers, data=data, timeout=HTTP_TIMEOUT,
-                                allow_redirects=True)
+        return self.sessions.request(method=method, url=url, headers=headers, data=data, timeout=HTTP_TIMEOUT,
+                                     allow_redirects=True)
+
+
+class _AsyncApi(_Api):
+    """The base class of an asyncio-native external API processor, the variant of _Api for async handlers.
+
+    Its handlers implement the coroutine _update_rate (or _fetch_rates for bulk ones) and send requests with
+    the async methods of this class (_send_request_async, _send_json_request_async), which share responses within
+    a refresh cycle, are guarded by the circuit breaker and hedged with mirrors, and are logged just like the sync
+    ones. update_rates_async refreshes their pairs on one event loop without a thread per request. The handlers
+    can be used by the sync code as well (update_rate, update_rates), their coroutines run on the event loop
+    of the process then.
+
+    Attributes:
+        async_sessions (AsyncSessionManager): the pooled async HTTP sessions shared by all the async handlers.
+
+    """
+
+    async_sessions = async_sessions
+
+    def fetch_rate(self, xrate):
+        """Obtain the new value of the exchange rate on the event loop of the process, see fetch_rate_async."""
+        return event_loop.run(self.fetch_rate_async(xrate))
+
+    def fetch_rates(self):
+        """Obtain all the exchange rates of a bulk handler on the event loop of the process, see fetch_rates_async."""
+        return event_loop.run(self.fetch_rates_async())
+
+    async def fetch_rate_async(self, xrate):
+        """Obtain the new value of the exchange rate without storing it in the DB, like _Api.fetch_rate does.
+
+        Args:
+            xrate (XRate): the corresponding DB entity.
+
+        Returns:
+            float: The new value of the exchange rate.
+
+        """
+        self.log.info("Started update for: %s" % xrate)
+        self.log.debug("Rate before: %s", xrate)
+
+        if self.bulk:
+            # Bulk handlers take the rate from all the rates provided by the external API
+            rates = await self.fetch_rates_async()
+            if (xrate.from_currency, xrate.to_currency) not in rates:
+                raise ValueError(f"Rate {xrate.from_currency}=>{xrate.to_currency} is not provided by {self.module}")
+            rate = rates[(xrate.from_currency, xrate.to_currency)]
+        else:
+            rate = await self._update_rate(xrate)
+
+        self.log.debug("Rate fetched: %s", rate)
+        return rate
+
+    async def fetch_rates_async(self):
+        """Obtain all the exchange rates provided by the external API of a bulk handler, like _Api.fetch_rates does.
+
+        Returns:
+            dict: (from_currency, to_currency) => the exchange rate.
+
+        """
+        return await _shared_async(("rates", self.module), self._fetch_rates)
+
+    async def _update_rate(self, xrate):
+        """This abstract coroutine have to be implemented in each derived async classes-handlers,
+        the same way as _Api._update_rate.
+
+        Args:
+            xrate (Xrate): the corresponding DB entity.
+
+        """
+        raise NotImplementedError("_update_rate")
+
+    async def _send_request_async(self, url, method, data=None, headers=None):
+        """The same as _send_request, but the request is sent by the async session.
+
+        Returns:
+            Response: The read response of the external API.
+
+        """
+        return await _shared_async(self._request_key("response", url, method, data, headers),
+                                   lambda: self._send_guarded_request_async(url, method, data, headers))
+
+    async def _send_json_request_async(self, url, method, data=None, headers=None):
+        """The same as _send_json_request, but the request is sent by the async session.
+
+        Returns:
+            any: The parsed JSON response of the external API.
+
+        """
+        async def load():
+            return (await self._send_request_async(url, method, data, headers)).json()
+
+        return await _shared_async(self._request_key("json", url, method, data, headers), load)
+
+    async def _send_guarded_request_async(self, url, method, data=None, headers=None):
+        """The same as _send_guarded_request, the mirrors are requested by tasks of the running loop."""
+        self.breaker.allow()
+        started = time.monotonic()
+        try:
+            urls = [url, *self.mirrors.get(url, ())]
+            if len(urls) == 1:
+                response = await self._send_logged_request_async(url, method, data, headers)
+            else:
+                delay = self.latency.percentile(HEDGE_PERCENTILE) or HEDGE_DELAY
+                response = await hedged_async([lambda url=url: self._send_logged_request_async(url, method, data, headers)
+                                               for url in urls], delay)
+        except BaseException as ex:
+            # An interrupted call (f.e. cancelled or stopped by a signal) is failed too, so a trial call is never lost
+            self.breaker.record(time.monotonic() - started, ex)
+            raise
+
+        elapsed = time.monotonic() - started
+        self.latency.add(elapsed)
+        self.breaker.record(elapsed)
+        return response
+
+    async def _send_logged_request_async(self, url, method, data=None, headers=None):
+        """The same as _send_logged_request, but the request is sent by the async session."""
+        log = self._request_log(url, method, data, headers)
+        try:
+            response = await self._send_async(method=method, url=url, headers=headers, data=data)
+            log["response_text"] = response.text
+            return response
+        except Exception as ex:
+            self._log_error(log, ex)
+            raise
+        finally:
+            log["finished"] = peewee_datetime.datetime.now()
+            log_sink.write(ApiLog, **log)
+
+    async def _send_async(self, url, method, data=None, headers=None):
+        """This auxiliary coroutine is responsible for actual sending the request, the same way as _send.
+
+        It is necessary in order to replace it with a mock in testing.
+
+        """
+        return await self.async_sessions.request(method=method, url=url, headers=headers, data=data,
+                                                 allow_redirects=True)
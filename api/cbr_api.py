@@ -1,91 +1,88 @@
 """This module contains class that handles retrieving exchange rates
-from USD (840) to RUB (643) using Russian Central Bank's API
+from USD (840), EUR (978), etc. to RUB (643) using Russian Central Bank's API
 
 """
 
+import io
 import xml.etree.ElementTree as ET
 
-from api import _Api
+from api import _Api, registry, creating_rates
+from api.currencies import CODES
 
 
 class Api(_Api):
     """The class that describes data requesting and retrieving from an external data source.
 
     Attributes:
-        __aliases_map (dict): Currency codes and their abbreviations FROM what this handler can convert to UAH.
+        __url (str): the URL of the daily rates document.
+        refresh_interval (int): the base refresh interval of the handler's rates, in seconds.
+        min_refresh_interval (int): the shortest refresh interval of the handler's rates, in seconds.
+        fresh_ttl (int): the age of the handler's rates up to which they are fresh, in seconds.
+        expire_ttl (int): the age of the handler's rates up to which they are stale, in seconds.
+        mirrors (dict): the mirror of the daily rates document.
 
     """
 
-    __aliases_map = {840: "USD"}
+    __url = "http://www.cbr.ru/scripts/XML_daily.asp"
+    # The rates are published once a day
+    refresh_interval = 6 * 60 * 60
+    min_refresh_interval = 60 * 60
+    fresh_ttl = 26 * 60 * 60
+    expire_ttl = 3 * 24 * 60 * 60
+    mirrors = {__url: ["https://www.cbr-xml-daily.ru/daily_utf8.xml"]}
 
     def __init__(self):
         # Initialize corresponding logger using the constructor from the base class
         super().__init__("CbrApi")
 
-    def _update_rate(self, xrate):
-        """The main method of this class-handler. It must return the final rate.
+    def _fetch_rates(self):
+        """The main method of this class-handler. It must return all the rates provided by the external source.
 
-        This method will be called from the update_rate method that is described in the base class _API.
-
-        Args:
-            xrate (XRate): the corresponding DB entity.
+        This method will be called from the fetch_rates method that is described in the base class _API.
+        The daily document contains the rates of all currencies, so it is requested and parsed once per refresh
+        cycle into the index of the handler's rates, and every CBR-backed pair takes its rate from the index.
 
         Returns:
-            float: The value of exchange rate retrieved from the external source.
-
-        """
-        rate = self._get_cbr_rate(xrate.from_currency)
-        return rate
-
-    def _get_cbr_rate(self, from_currency):
-        """The auxiliary method that describes the algorithm of the corresponding external data source processing.
-
-        Args:
-            from_currency (int): the international digital code of the currency to be exchanged from.
-
-        Returns:
-            float: The value of exchange rate retrieved from the external source.
+            dict: (from_currency, 643) => the value of exchange rate retrieved from the external source.
 
         """
 
         # Send request to the external data source using _send_request method from the base class
-        response = self._send_request(url="http://www.cbr.ru/scripts/XML_daily.asp", method="get")
-        self.log.debug("response.encoding: %s" % response.encoding)
-
-        response_text = response.text
-        self.log.debug("response.text: %s" % response_text)
+        response = self._send_request(url=self.__url, method="get")
 
-        # Parse the response json to find the latest exchange rate value
-        rate = self._find_rate(response_text, from_currency)
+        # Only the currencies of the stored pairs are looked for, unless new pairs are created from the document
+        codes = None if creating_rates() else \
+            {xrate.from_currency for xrate in registry.xrates() if xrate.module == self.module}
+        rates = {(code, CODES["RUB"]): rate for code, rate in self._parse_rates(response.content, codes).items()}
+        self.log.debug("Rates parsed: %s" % rates)
+        return rates
 
-        return rate
+    @staticmethod
+    def _parse_rates(content, codes):
+        """The auxiliary method that performs the data source's response parsing to find the exchange rates values.
 
-    def _find_rate(self, response_text, from_currency):
-        """The auxiliary method that performs the data source's response parsing to find the exchange rate value.
+        The raw XML is parsed incrementally, Valute by Valute, without building the whole tree,
+        and the parsing stops as soon as all the requested currencies are found.
 
         Args:
-            response_data (dict): json-formatted response from the data source
-            from_currency (int): the international digital code of the currency to be exchanged from.
+            content (bytes): the raw XML response of the data source.
+            codes (set): the international digital codes of the currencies to find, all of them if None.
 
         Returns:
-            float: The value of exchange rate retrieved from the external source.
+            dict: The found codes => their exchange rates to RUB (per one unit of the currency).
 
         """
-
-        # Perform the check to make us sure that we're not trying to use this handler for non-specified currencies
-        if from_currency not in self.__aliases_map:
-            raise ValueError(f"Invalid from_currency: {from_currency}")
-
-        # Convert XML text to convenient for processing format
-        root = ET.fromstring(response_text)
-        valutes = root.findall("Valute")
-
-        # Get corresponding currency abbreviations exchange rate to UAH from what we're interested in during this call.
-        currency_cbr_alias = self.__aliases_map[from_currency]
-
-        # Look for the object from the json which contains the corresponding abbreviation like "from currency" value
-        for valute in valutes:
-            if valute.find('CharCode').text == currency_cbr_alias:
-                return float(valute.find("Value").text.replace(",", "."))
-
-        raise ValueError("Invalid Cbr response: %s not found" % from_currency)
+        rates = {}
+        for _, element in ET.iterparse(io.BytesIO(content)):
+            if element.tag != "Valute":
+                continue
+
+            code = int(element.findtext("NumCode"))
+            if codes is None or code in codes:
+                # Rates of some currencies are given per 10, 100, etc. units
+                value = float(element.findtext("Value").replace(",", "."))
+                rates[code] = value / int(element.findtext("Nominal", "1"))
+                if codes is not None and len(rates) == len(codes):
+                    break
+            element.clear()
+        return rates
@@ -12,10 +12,21 @@ class Api(_Api):
 
     Attributes:
         __aliases_map (dict): Currency codes and their abbreviations FROM what this handler can convert to UAH.
+        refresh_interval (int): the base refresh interval of the handler's rates, in seconds.
+        min_refresh_interval (int): the shortest refresh interval of the handler's rates, in seconds.
+        max_refresh_interval (int): the longest refresh interval of the handler's rates, in seconds.
+        fresh_ttl (int): the age of the handler's rates up to which they are fresh, in seconds.
+        expire_ttl (int): the age of the handler's rates up to which they are stale, in seconds.
 
     """
 
     __aliases_map = {1000: "btc", 980: "uah"}
+    # The free plan limits the number of calls per day
+    refresh_interval = 10 * 60
+    min_refresh_interval = 5 * 60
+    max_refresh_interval = 60 * 60
+    fresh_ttl = 15 * 60
+    expire_ttl = 2 * 60 * 60
 
     def __init__(self):
         # Initialize corresponding logger using the constructor from the base class
@@ -61,9 +72,8 @@ class Api(_Api):
               f"CMC_PRO_API_KEY={api_key}&sort=market_cap&start=1&limit=10&cryptocurrency_type=tokens" \
               f"&convert={url_end}"
 
-        # Send request to the external data source using _send_request method from the base class
-        response = self._send_request(url=url, method="get")
-        response_json = response.json()
+        # Send request to the external data source using _send_json_request method from the base class
+        response_json = self._send_json_request(url=url, method="get")
         self.log.debug("Coinmarketcap response: %s" % response_json)
 
         # Parse the response json to find the latest exchange rate value
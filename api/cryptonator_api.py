@@ -3,27 +3,41 @@ from BTC (1000) to UAH (980), RUB (643) and USD (840) using Cryptonator API
 
 """
 
-from api import _Api
+from api import _AsyncApi
 
 
-class Api(_Api):
+class Api(_AsyncApi):
     """The class that describes data requesting and retrieving from an external data source.
 
+    Every pair is a separate request to the ticker, so this handler is an async one: the requests of all its pairs
+    are sent concurrently by coroutines, within the limit of connections to the host.
+
     Attributes:
         __aliases_map (dict): Currency codes and their abbreviations FROM what this handler can convert to UAH.
+        refresh_interval (int): the base refresh interval of the handler's rates, in seconds.
+        min_refresh_interval (int): the shortest refresh interval of the handler's rates, in seconds.
+        max_refresh_interval (int): the longest refresh interval of the handler's rates, in seconds.
+        fresh_ttl (int): the age of the handler's rates up to which they are fresh, in seconds.
+        expire_ttl (int): the age of the handler's rates up to which they are stale, in seconds.
 
     """
 
     __aliases_map = {1000: "btc", 980: "uah", 643: "rub"}
+    # Cryptocurrencies rates change every second
+    refresh_interval = 5 * 60
+    min_refresh_interval = 60
+    max_refresh_interval = 60 * 60
+    fresh_ttl = 15 * 60
+    expire_ttl = 2 * 60 * 60
 
     def __init__(self):
         # Initialize corresponding logger using the constructor from the base class
         super().__init__("CryptonatorApi")
 
-    def _update_rate(self, xrate):
-        """The main method of this class-handler. It must return the final rate.
+    async def _update_rate(self, xrate):
+        """The main coroutine of this class-handler. It must return the final rate.
 
-        This method will be called from the update_rate method that is described in the base class _API.
+        This coroutine will be called from the fetch_rate_async method that is described in the base class _AsyncApi.
 
         Args:
             xrate (XRate): the corresponding DB entity.
@@ -32,11 +46,11 @@ class Api(_Api):
             float: The value of exchange rate retrieved from the external source.
 
         """
-        rate = self._get_api_rate(xrate.from_currency, xrate.to_currency)
+        rate = await self._get_api_rate(xrate.from_currency, xrate.to_currency)
         return rate
 
-    def _get_api_rate(self, from_currency, to_currency):
-        """The auxiliary method that describes the algorithm of the corresponding external data source processing.
+    async def _get_api_rate(self, from_currency, to_currency):
+        """The auxiliary coroutine that describes the algorithm of the corresponding external data source processing.
 
         Args:
             from_currency (int): the international digital code of the currency to be exchanged from.
@@ -72,11 +86,10 @@ class Api(_Api):
             'cache-control': 'no-cache',
             'authority': 'www.appannie.com'
         }
-        # Send request to the external data source using _send_request method from the base class
-        response = self._send_request(url=url,
-                                      method="get",
-                                      headers=headers)
-        response_json = response.json()
+        # Send request to the external data source using _send_json_request_async method from the base class
+        response_json = await self._send_json_request_async(url=url,
+                                                            method="get",
+                                                            headers=headers)
         self.log.debug("Cryptonator response: %s" % response_json)
 
         # Parse the response json to find the latest exchange rate value
@@ -0,0 +1,10 @@
+"""This module contains the international digital codes of the currencies known to the external APIs handlers."""
+
+# Currency abbreviations => international digital codes (ISO 4217), 1000 is used for Bitcoin.
+# Some external APIs use the outdated abbreviation RUR for the Russian ruble
+CODES = {
+    "AUD": 36, "BRL": 986, "BTC": 1000, "CAD": 124, "CHF": 756, "CLP": 152, "CNY": 156, "CZK": 203, "DKK": 208,
+    "EUR": 978, "GBP": 826, "HKD": 344, "HUF": 348, "INR": 356, "ISK": 352, "JPY": 392, "KRW": 410, "KZT": 398,
+    "NOK": 578, "NZD": 554, "PLN": 985, "RON": 946, "RUB": 643, "RUR": 643, "SEK": 752, "SGD": 702, "THB": 764,
+    "TRY": 949, "TWD": 901, "UAH": 980, "USD": 840,
+}
@@ -0,0 +1,93 @@
+"""This module contains the event loop that runs the coroutines of the async external API handlers."""
+
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import Future
+from contextvars import copy_context
+
+from api.sessions import async_sessions
+
+
+class EventLoop:
+    """The class that keeps an asyncio event loop running in a background thread of the process.
+
+    All the coroutines of the process run on this one loop, so the async handlers reuse their pooled HTTP sessions
+    between refreshes instead of opening new connections on a new loop every time. Sync code waits for the coroutines
+    it runs, and they are executed in the caller's context (f.e. they see its refresh cycle).
+
+    The loop is started lazily and restarted in forked processes (f.e. gunicorn workers), because a running loop
+    and its connections must not be shared between processes. The HTTP sessions are closed at the process exit.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def run(self, coro):
+        """Run the coroutine on the loop and wait for its result.
+
+        Args:
+            coro (coroutine): the coroutine to run.
+
+        Returns:
+            any: The result of the coroutine.
+
+        Raises:
+            RuntimeError: If it is called from a coroutine of the loop, which would wait for itself forever.
+
+        """
+        loop = self._start()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("The event loop can't wait for its own coroutine, await it instead")
+
+        future = Future()
+        # The task is created in a copy of the caller's context, and a task keeps the context it was created in
+        loop.call_soon_threadsafe(self._create_task, coro, future, context=copy_context())
+        return future.result()
+
+    def stop(self):
+        """Close the HTTP sessions of the loop and stop it."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop = self._thread = None
+
+        asyncio.run_coroutine_threadsafe(async_sessions.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    @staticmethod
+    def _create_task(coro, future):
+        task = asyncio.ensure_future(coro)
+
+        def done(task):
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task.add_done_callback(done)
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="EventLoop", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+                atexit.register(self.stop)
+            return self._loop
+
+
+# The event loop shared by all the async handlers of the process
+event_loop = EventLoop()
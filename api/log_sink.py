@@ -0,0 +1,136 @@
+"""This module contains the background writer of external API calls and errors logs."""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+from config import logging, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE, LOG_PUT_TIMEOUT
+from models import db_logs, write_transaction
+
+# The marker that stops the writer thread
+_STOP = object()
+
+
+class LogSink:
+    """The class that writes log entities to the logs DB in a background thread with bulk inserts.
+
+    Writing an ApiLog (and an ErrorLog) entity in the request sending code blocks every rate update on the logs DB.
+    Instead, log records are put into a bounded queue and the writer thread inserts them in batches, when
+    the batch is full or the flush interval is over. When the queue is full (the DB can't keep up), writing a record
+    waits a little (backpressure) and then drops the record, so memory stays bounded and updates never hang.
+    Everything queued is written on flush, stop and at the process exit.
+
+    Attributes:
+        batch_size (int): the maximum number of records written with one bulk insert.
+        flush_interval (float): the maximum number of seconds a record waits in the queue.
+        put_timeout (float): the maximum number of seconds to wait for a room in a full queue.
+        dropped (int): the number of records dropped because of a full queue.
+
+    """
+
+    def __init__(self, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL, queue_size=LOG_QUEUE_SIZE,
+                 put_timeout=LOG_PUT_TIMEOUT):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self.log = logging.getLogger("Api.LogSink")
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def write(self, model, **fields):
+        """Queue a log entity to be written.
+
+        Args:
+            model (Model): the log model class (f.e. ApiLog or ErrorLog).
+            fields: the values of the entity fields.
+
+        """
+        self._start()
+        try:
+            self._queue.put((model, fields), timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+            self.log.warning("Logs queue is full, %s record dropped (%s in total)" % (model.__name__, self.dropped))
+
+    def flush(self):
+        """Write all the queued log entities and wait until they are written."""
+        if self._running():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait()
+
+    def stop(self):
+        """Write all the queued log entities and stop the writer thread."""
+        with self._lock:
+            if self._running():
+                self._queue.put(_STOP)
+                self._thread.join()
+            self._thread = None
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _start(self):
+        # The writer thread is not inherited by forked processes (f.e. gunicorn workers), so it is started per process
+        if self._running():
+            return
+        with self._lock:
+            if not self._running():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="LogSink", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(pending)
+                return
+
+            if isinstance(item, threading.Event):
+                self._write(pending)
+                pending, deadline = [], None
+                item.set()
+                continue
+
+            if item is not None:
+                pending.append(item)
+                deadline = deadline or time.monotonic() + self.flush_interval
+
+            if len(pending) >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                self._write(pending)
+                pending, deadline = [], None
+
+    def _write(self, records):
+        if not records:
+            return
+
+        models = {}
+        for model, fields in records:
+            models.setdefault(model, []).append(fields)
+
+        try:
+            with db_logs.connection_context(), write_transaction(db_logs):
+                for model, rows in models.items():
+                    model.insert_logs(rows)
+        except Exception:
+            self.log.exception("Error during logs writing, %s records lost" % len(records))
+
+
+# The sink shared by all external API handlers of the process, it is flushed when the process exits
+log_sink = LogSink()
+atexit.register(log_sink.stop)
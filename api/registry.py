@@ -0,0 +1,127 @@
+"""This module contains the registry of external API handlers and the routing of exchange rates to them."""
+
+import importlib
+import pkgutil
+import threading
+
+import api
+from config import RATES_UPDATE_INTERVAL
+from models import XRate
+
+
+class HandlerRegistry:
+    """The class that keeps long-lived instances of all API handlers and knows which one updates every rate.
+
+    Handler modules are discovered in the api package once (every module named like "*_api" that contains
+    the Api class, except the test ones), and their handlers are created once and reused for all the following
+    updates.
+    The routing table maps a currencies combination to its handler and DB entity, so finding the handler
+    of a rate is a dict lookup instead of a DB query plus a module import.
+
+    Attributes:
+        excluded_modules (frozenset): the modules with handlers that only simulate external APIs, so they must never
+            update real rates.
+
+    """
+
+    excluded_modules = frozenset({"test_api"})
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._handlers = None
+        self._routes = None
+
+    def load(self):
+        """Discover and instantiate all the handlers and build the routing table of the rates from the DB."""
+        with self._lock:
+            self._handlers = {}
+            for module_info in pkgutil.iter_modules(api.__path__):
+                if module_info.name.endswith("_api") and module_info.name not in self.excluded_modules:
+                    module = importlib.import_module(f"api.{module_info.name}")
+                    self._handlers[module_info.name] = module.Api()
+            self.reload_routes()
+
+    def reload_routes(self):
+        """Rebuild the routing table, should be called after the rates were added to the DB or changed their modules."""
+        with self._lock:
+            self._routes = {(xrate.from_currency, xrate.to_currency): xrate
+                            for xrate in XRate.select().where(XRate.module.not_in(self.excluded_modules))}
+
+    def handler(self, module):
+        """Return the handler implemented in the given module of the api package.
+
+        Args:
+            module (str): the name of the handler module.
+
+        Returns:
+            _Api: The handler instance.
+
+        """
+        if self._handlers is None:
+            self.load()
+        if module not in self._handlers:
+            raise ValueError(f"Unknown API module: {module}")
+        return self._handlers[module]
+
+    def known(self, module):
+        """Return whether the given module of the api package has a handler, the excluded modules have none.
+
+        Args:
+            module (str): the name of the handler module.
+
+        Returns:
+            bool: True if the rates of the module can be updated.
+
+        """
+        if self._handlers is None:
+            self.load()
+        return module in self._handlers
+
+    def resolve(self, from_currency, to_currency):
+        """Find the handler responsible for the rate and the corresponding DB entity.
+
+        Args:
+            from_currency (int): the international digital code of the currency to be exchanged from.
+            to_currency (int): the international digital code of the currency to be exchanged to.
+
+        Returns:
+            tuple: The handler (_Api) and the DB entity (XRate).
+
+        """
+        if self._routes is None:
+            self.load()
+
+        xrate = self._routes.get((from_currency, to_currency))
+        if xrate is None:
+            # The rate could have been added after the routes were built
+            self.reload_routes()
+            xrate = self._routes.get((from_currency, to_currency))
+            if xrate is None:
+                raise ValueError(f"Unknown currencies combination: {from_currency}=>{to_currency}")
+
+        return self.handler(xrate.module), xrate
+
+    def min_refresh_interval(self):
+        """Return the shortest interval in seconds any rate can be refreshed with.
+
+        Returns:
+            int: The interval, it bounds how long responses with the rates can be cached by clients.
+
+        """
+        return min((min(self.handler(xrate.module).min_refresh_interval, xrate.refresh_interval or float("inf"))
+                    for xrate in self.xrates()), default=RATES_UPDATE_INTERVAL)
+
+    def xrates(self):
+        """Return the DB entities of all the routed rates.
+
+        Returns:
+            list: XRate entities.
+
+        """
+        if self._routes is None:
+            self.load()
+        return list(self._routes.values())
+
+
+# The registry shared by the whole process
+registry = HandlerRegistry()
@@ -0,0 +1,185 @@
+"""This module contains the tools that keep rates refreshing fast when external APIs fail or slow down."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import BREAKER_FAILURES, BREAKER_SLOW_CALL, BREAKER_RESET_TIMEOUT, HEDGE_WINDOW, HEDGE_MIN_SAMPLES
+
+
+class CircuitOpenError(Exception):
+    """The exception raised instead of calling an external API whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """The class that stops calling an external API after it failed or was too slow several times in a row.
+
+    While the breaker is closed, calls pass through and their outcomes are counted. After the given number
+    of consecutive failed or slow calls the breaker opens, and calls fail immediately with CircuitOpenError
+    (without waiting for the HTTP timeout and without writing an error log every time). When the reset timeout
+    is over, the breaker lets one trial call through: its success closes the breaker, its failure opens it again.
+
+    Attributes:
+        name (str): the name of the protected external API.
+        failure_threshold (int): the number of consecutive failed calls that opens the breaker.
+        slow_call (float): the duration of a call in seconds that counts it as failed.
+        reset_timeout (float): the number of seconds the breaker stays open before a trial call.
+        failures (int): the current number of consecutive failed calls.
+
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, slow_call=BREAKER_SLOW_CALL,
+                 reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._opened = None
+        self._trial = False
+
+    @property
+    def state(self):
+        """str: "closed", "open" or "half-open" (the reset timeout is over, a trial call is allowed)."""
+        if self._opened is None:
+            return "closed"
+        return "open" if time.monotonic() - self._opened < self.reset_timeout else "half-open"
+
+    def allow(self):
+        """Check that a call can be made, it has to be called before every call.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or a trial call is already in progress.
+
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "open" or self._trial:
+                raise CircuitOpenError(f"Circuit breaker of {self.name} is open after {self.failures} failures")
+            self._trial = True
+
+    def record(self, elapsed=0.0, ex=None):
+        """Count the outcome of an allowed call.
+
+        Args:
+            elapsed (float): (optional) the duration of the call in seconds.
+            ex (Exception): (optional) the exception the call failed with.
+
+        """
+        with self._lock:
+            self._trial = False
+            if ex is None and elapsed < self.slow_call:
+                self.failures = 0
+                self._opened = None
+                return
+
+            self.failures += 1
+            if self._opened is not None or self.failures >= self.failure_threshold:
+                self._opened = time.monotonic()
+
+    def reset(self):
+        """Close the breaker."""
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+
+
+class LatencyTracker:
+    """The class that keeps the latest durations of calls to an external API and their percentiles.
+
+    Attributes:
+        min_samples (int): the number of durations needed to compute percentiles.
+
+    """
+
+    def __init__(self, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, elapsed):
+        """Add the duration of a call in seconds."""
+        with self._lock:
+            self._samples.append(elapsed)
+
+    def percentile(self, percent):
+        """Return the percentile of the latest durations in seconds, None if there are not enough of them yet."""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def hedged(calls, delay):
+    """Make the first call, and the next ones only if no call has succeeded within the delay after the previous one.
+
+    The next call is made at once when the previous one fails. Calls which are not needed anymore are not waited for.
+
+    Args:
+        calls (list): the functions without arguments, f.e. requests to the same resource on different mirrors.
+        delay (float): the number of seconds to wait for a call before making the next one.
+
+    Returns:
+        any: The result of the first successful call.
+
+    Raises:
+        Exception: The exception of the first call, if all the calls failed.
+
+    """
+    executor = ThreadPoolExecutor(max_workers=len(calls))
+    futures, pending = [], set()
+    try:
+        for index, call in enumerate(calls):
+            future = executor.submit(call)
+            futures.append(future)
+            pending.add(future)
+            timeout = delay if index < len(calls) - 1 else None
+
+            while pending:
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                if not done or timeout is not None:
+                    # The delay is over or the call failed, so the next call is made
+                    break
+
+        raise futures[0].exception()
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def hedged_async(calls, delay):
+    """The same as hedged, but the calls are coroutine functions which run as tasks of the current event loop.
+
+    Calls which are not needed anymore are cancelled.
+
+    """
+    tasks, pending = [], set()
+    try:
+        for index, call in enumerate(calls):
+            task = asyncio.ensure_future(call())
+            tasks.append(task)
+            pending.add(task)
+            timeout = delay if index < len(calls) - 1 else None
+
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not done or timeout is not None:
+                    # The delay is over or the call failed, so the next call is made
+                    break
+
+        raise tasks[0].exception()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,107 @@
+"""This module contains the adaptive schedule of exchange rates refreshing."""
+
+import threading
+
+from config import REFRESH_BACKOFF, REFRESH_VOLATILITY, REFRESH_TICK_INTERVAL
+from models import peewee_datetime
+from api.registry import registry
+
+
+class _PairSchedule:
+    """The refresh state of one pair: the current interval in seconds and the time when the pair is due."""
+
+    __slots__ = ("interval", "due")
+
+    def __init__(self, interval, due):
+        self.interval = interval
+        self.due = due
+
+
+class RefreshSchedule:
+    """The class that decides when every exchange rate has to be refreshed.
+
+    Every pair starts with its base interval, which is set on the XRate entity (refresh_interval) or, by default,
+    by its handler class (refresh_interval). After every refresh the interval adapts within the handler's bounds
+    (min_refresh_interval and max_refresh_interval): it grows when the rate didn't change, so rarely published
+    rates (f.e. the daily CBR ones) are not fetched for nothing, and shrinks when the rate moved significantly,
+    so volatile rates (f.e. BTC) are fetched more often while they are volatile. The interval never grows beyond
+    the handler's fresh_ttl, so the scheduler refreshes every rate before it turns stale, and the rates API
+    doesn't have to revalidate it on the clients' requests.
+
+    Attributes:
+        backoff (float): the factor the interval grows or shrinks by.
+        volatility (float): the relative change of a rate that makes its interval shrink.
+
+    """
+
+    def __init__(self, backoff=REFRESH_BACKOFF, volatility=REFRESH_VOLATILITY):
+        self.backoff = backoff
+        self.volatility = volatility
+        self._lock = threading.Lock()
+        self._pairs = {}
+
+    def due(self, now=None):
+        """Find the rates that have to be refreshed.
+
+        The routes of the registry are rebuilt first, so the pairs added or moved to other modules since the previous
+        check (f.e. by manual edits or by the web workers) are scheduled without a restart.
+
+        Args:
+            now (datetime): (optional) the current date and time.
+
+        Returns:
+            list: XRate entities that are due.
+
+        """
+        now = now or peewee_datetime.datetime.now()
+        registry.reload_routes()
+        with self._lock:
+            return [xrate for xrate in registry.xrates() if self._state(xrate).due <= now]
+
+    def record(self, xrate, previous_rate, ex=None, now=None):
+        """Adapt the interval of the pair to the outcome of its refresh and schedule the next one.
+
+        Args:
+            xrate (XRate): the refreshed XRate entity.
+            previous_rate (float): the rate before the refresh.
+            ex (Exception): (optional) the exception occurred during the refresh, if any.
+            now (datetime): (optional) the time of the refresh.
+
+        """
+        now = now or peewee_datetime.datetime.now()
+        low, high = self._bounds(xrate)
+        with self._lock:
+            state = self._state(xrate)
+            if ex is None and xrate.rate == previous_rate:
+                state.interval = min(state.interval * self.backoff, high)
+            elif ex is None and previous_rate and abs(xrate.rate - previous_rate) / abs(previous_rate) >= self.volatility:
+                state.interval = max(state.interval / self.backoff, low)
+            state.due = now + peewee_datetime.timedelta(seconds=state.interval)
+
+    def interval(self, from_currency, to_currency):
+        """Return the current refresh interval of the pair in seconds, None if it hasn't been scheduled yet."""
+        with self._lock:
+            state = self._pairs.get((from_currency, to_currency))
+            return state and state.interval
+
+    def _state(self, xrate):
+        key = (xrate.from_currency, xrate.to_currency)
+        state = self._pairs.get(key)
+        if state is None:
+            # The first refresh is due one base interval after the stored update, so restarts don't refresh everything
+            interval = self._base(xrate)
+            state = self._pairs[key] = _PairSchedule(interval, xrate.updated + peewee_datetime.timedelta(seconds=interval))
+        return state
+
+    def _base(self, xrate):
+        return xrate.refresh_interval or registry.handler(xrate.module).refresh_interval
+
+    def _bounds(self, xrate):
+        handler, base = registry.handler(xrate.module), self._base(xrate)
+        # The pair has to be refreshed at least one tick before it turns stale, as it is checked once per tick
+        longest = min(handler.max_refresh_interval, handler.fresh_ttl - REFRESH_TICK_INTERVAL)
+        return min(handler.min_refresh_interval, base), max(longest, base)
+
+
+# The schedule of the rates refreshed by the scheduler process
+schedule = RefreshSchedule()
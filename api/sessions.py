@@ -0,0 +1,189 @@
+"""This module contains the managers of HTTP sessions shared by all external API handlers."""
+
+import asyncio
+import json
+import os
+import threading
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import HTTP_TIMEOUT, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_RETRIES, HTTP_BACKOFF_FACTOR, \
+    ASYNC_HTTP_LIMIT, ASYNC_HTTP_LIMIT_PER_HOST
+
+
+class SessionManager:
+    """The class that keeps a pooled keep-alive HTTP session for sending requests to external APIs.
+
+    Sending every request with the module-level requests.request function opens a new connection each time,
+    so every rate update pays for DNS resolving, TCP and TLS handshakes again. The session keeps a pool of
+    connections per host and reuses them, and it also retries failed requests with an exponential backoff.
+
+    The session is created lazily and recreated in forked processes (f.e. gunicorn workers),
+    because connections must not be shared between processes.
+
+    Attributes:
+        pool_connections (int): the number of hosts to keep connection pools for.
+        pool_maxsize (int): the maximum number of connections kept in the pool of every host.
+        retries (int): the number of retries of failed requests (connection errors and 429/5xx responses).
+        backoff_factor (float): the factor of the exponential delay between retries.
+
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def session(self):
+        """Return the session of the current process, creating it if necessary.
+
+        Returns:
+            requests.Session: The shared session.
+
+        """
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = self._create_session()
+                self._pid = os.getpid()
+            return self._session
+
+    def request(self, method, url, **kwds):
+        """Send the request using the shared session, all the arguments are the same as for requests.request."""
+        return self.session().request(method=method, url=url, **kwds)
+
+    def close(self):
+        """Close the session and all the connections kept in its pools."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _create_session(self):
+        retry = Retry(total=self.retries, backoff_factor=self.backoff_factor, status_forcelist=self.retry_statuses)
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+
+class Response:
+    """The response of an external API read by the async session, with the same interface as requests.Response
+    has for the handlers (text, content and json), so the responses of both runtimes are processed alike.
+
+    Attributes:
+        status_code (int): the HTTP status code.
+        content (bytes): the raw response body.
+        encoding (str): the charset of the response, if it was specified.
+
+    """
+
+    def __init__(self, status_code, content, encoding=None):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        """str: The decoded response body."""
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        """Return the parsed JSON response body."""
+        return json.loads(self.text)
+
+
+class AsyncSessionManager:
+    """The class that keeps pooled keep-alive aiohttp sessions for sending requests to external APIs from coroutines.
+
+    An aiohttp session can only be used on the event loop it was created on, so a session is kept for every loop.
+    The connector of a session limits the number of simultaneous connections in total and to every host,
+    so refreshing hundreds of pairs at once never opens hundreds of connections to the same external API:
+    the requests beyond the limit wait for a free connection instead.
+    Failed requests are retried with an exponential backoff, the same way as the sync sessions do.
+
+    Attributes:
+        limit (int): the maximum number of simultaneous connections.
+        limit_per_host (int): the maximum number of simultaneous connections to the same host.
+        timeout (int): the total timeout of a request in seconds.
+        retries (int): the number of retries of failed requests (connection errors and 429/5xx responses).
+        backoff_factor (float): the factor of the exponential delay between retries.
+
+    """
+
+    retry_statuses = SessionManager.retry_statuses
+
+    def __init__(self, limit=ASYNC_HTTP_LIMIT, limit_per_host=ASYNC_HTTP_LIMIT_PER_HOST, timeout=HTTP_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def session(self):
+        """Return the session of the running event loop, creating it if necessary.
+
+        Returns:
+            aiohttp.ClientSession: The shared session.
+
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+                session = self._sessions[loop] = aiohttp.ClientSession(
+                    connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            return session
+
+    async def request(self, method, url, **kwds):
+        """Send the request using the session of the running loop and read the whole response.
+
+        All the arguments are the same as for aiohttp.ClientSession.request.
+
+        Returns:
+            Response: The read response, the last one if all the retries failed with a retried status.
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: If the last retry failed to get a response.
+
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                async with self.session().request(method=method, url=url, **kwds) as response:
+                    result = Response(response.status, await response.read(), response.charset)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+                continue
+            if result.status_code not in self.retry_statuses:
+                break
+        return result
+
+    async def close(self):
+        """Close the session of the running event loop and all the connections kept in its pool."""
+        with self._lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+# The managers shared by all external API handlers of the process
+sessions = SessionManager()
+async_sessions = AsyncSessionManager()
@@ -8,6 +8,7 @@ from flask import Flask
 
 import models
 import tasks
+from api.registry import registry
 from config import LOGGING
 
 dictConfig(LOGGING)
@@ -18,7 +19,19 @@ app = Flask(__name__)
 # within views module
 import views
 
-models.start_db()
+with models.db_connection():
+    models.start_db()
+    # Create all the API handlers once, they will be reused by every rates update
+    registry.load()
+
+
+# Requests take DB connections from the pools on their first query only, so the pages rendered
+# from the rates snapshot don't touch any DB
+@app.teardown_request
+def _db_close(exc):
+    """Return the request's DB connections to the pools."""
+    models.close_db()
+
 
 app.logger = logging.getLogger('GoldenEye')
 app.logger.removeHandler(default_handler)
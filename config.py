@@ -20,10 +20,116 @@ DB_CONN = {
 DB_PATH = "data/golden-eye.db"
 LOGS_DB_PATH = "data/golden-eye-logs.db"
 
+# Pools of DB connections, per process and per DB: the maximum number of open connections, the age in seconds
+# after which an idle connection is reopened, and the time in seconds to wait for a free connection
+DB_MAX_CONNECTIONS = 8
+DB_STALE_TIMEOUT = 300
+DB_POOL_TIMEOUT = 10
+
+# SQLite settings, used when PostgreSQL is not configured: the write-ahead log lets readers work alongside
+# the writer, commits are synced only at checkpoints, 64 MB of page cache and 256 MB of memory-mapped I/O
+# per connection, and the time in milliseconds a writer waits for the DB file write lock
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'busy_timeout': 30000,
+}
+
+# The snapshot of all the rates with the version of the rates set, it is replaced on every rates write,
+# shared by all the processes (web workers and the scheduler) and lets them know that their caches are outdated
+RATES_SNAPSHOT_PATH = "data/xrates.snapshot"
+
+# The maximum number of cached API responses per process
+RESPONSE_CACHE_SIZE = 256
+
+# Rates change events: the number of seconds between checks of the rates snapshot for a new version,
+# the maximum number of seconds without messages in an event stream, and the maximum number of
+# undelivered events per client
+EVENTS_POLL_INTERVAL = 1
+EVENTS_HEARTBEAT_INTERVAL = 15
+EVENTS_QUEUE_SIZE = 100
+
 JOBS_STORE = "data/jobs.db"
 
 HTTP_TIMEOUT = 15
 
+# Circuit breakers of external APIs handlers: the number of consecutive failed calls (or calls longer than
+# BREAKER_SLOW_CALL seconds) that opens a breaker, and the number of seconds it stays open before a trial call
+BREAKER_FAILURES = 3
+BREAKER_SLOW_CALL = 5
+BREAKER_RESET_TIMEOUT = 5 * 60
+
+# Hedged requests to external APIs mirrors: a backup request is sent when the primary one takes longer than
+# the HEDGE_PERCENTILE of the latest HEDGE_WINDOW calls durations, or HEDGE_DELAY seconds until there are
+# HEDGE_MIN_SAMPLES of them
+HEDGE_PERCENTILE = 95
+HEDGE_WINDOW = 100
+HEDGE_MIN_SAMPLES = 10
+HEDGE_DELAY = 2
+
+# Writing of external API calls logs in the background: the maximum size of one bulk insert,
+# the maximum delay before writing in seconds, the maximum number of queued records, and the time
+# to wait for a room in the full queue before the record is dropped
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 2
+LOG_QUEUE_SIZE = 10000
+LOG_PUT_TIMEOUT = 0.1
+
+# The default and the maximum number of logs per page
+LOGS_PAGE_SIZE = 10
+LOGS_MAX_PAGE_SIZE = 100
+
+# Logs of external API calls and errors are partitioned by weeks, partitions older than that are dropped
+LOGS_RETENTION_WEEKS = 4
+
+# How often the rates are updated by the scheduler by default, in seconds
+RATES_UPDATE_INTERVAL = 60 * 60
+
+# Freshness of served rates by their age in seconds, by default (handlers have their own values): fresh up to
+# RATES_FRESH_TTL, then stale (still served while being refreshed in the background) up to RATES_EXPIRE_TTL,
+# then expired
+RATES_FRESH_TTL = 2 * 60 * 60
+RATES_EXPIRE_TTL = 24 * 60 * 60
+
+# Create the pairs which are provided by bulk handlers (which get many rates in one response),
+# but are not stored in the DB yet, on every full rates refresh
+AUTO_CREATE_RATES = False
+
+# Adaptive rates refreshing: the scheduler checks which rates are due every REFRESH_TICK_INTERVAL seconds.
+# Rates are refreshed with the intervals of their handlers (RATES_UPDATE_INTERVAL by default) within bounds,
+# an interval grows REFRESH_BACKOFF times when the rate didn't change and shrinks as many times when the rate
+# changed by REFRESH_VOLATILITY (relative) or more
+REFRESH_TICK_INTERVAL = 30
+RATES_MIN_UPDATE_INTERVAL = 10 * 60
+RATES_MAX_UPDATE_INTERVAL = 24 * 60 * 60
+REFRESH_BACKOFF = 2
+REFRESH_VOLATILITY = 0.001
+
+# Pooling of HTTP connections to external APIs: the number of hosts to keep pools for, the number of
+# kept-alive connections per host, and retrying of failed requests with an exponential backoff
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+HTTP_RETRIES = 2
+HTTP_BACKOFF_FACTOR = 0.5
+
+# Rates refreshing concurrency: total number of worker threads and the limit of simultaneous
+# updates handled by the same API module (e.g. sent to the same external API)
+REFRESH_WORKERS = 16
+REFRESH_WORKERS_PER_MODULE = 2
+
+# Async rates refreshing: the scheduler refreshes all the rates on one event loop, async handlers send requests
+# with pooled aiohttp sessions limited to ASYNC_HTTP_LIMIT simultaneous connections in total
+# and ASYNC_HTTP_LIMIT_PER_HOST to every external API host
+ASYNC_REFRESH = True
+ASYNC_HTTP_LIMIT = 100
+ASYNC_HTTP_LIMIT_PER_HOST = 4
+
+# The default and the maximum number of entities returned by one request to the rates history API
+HISTORY_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+
 IP_LIST = ["127.0.0.1", "127.0.0.10"]
 
 LOGGING = {
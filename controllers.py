@@ -1,13 +1,25 @@
 """This module contains all app's controllers."""
 
-from datetime import datetime
+import csv
+import io
+import json
+from datetime import datetime, timezone
 
-from flask import render_template, make_response, jsonify, request, redirect, url_for
+from flask import render_template, make_response, jsonify, request, redirect, url_for, Response, stream_with_context
+from peewee import Tuple
 import xmltodict
 
 from app import app
-from models import XRate, ApiLog, ErrorLog, LatestUpdate
+from config import HISTORY_LIMIT, HISTORY_MAX_LIMIT, RESPONSE_CACHE_SIZE, LOGS_PAGE_SIZE, \
+    LOGS_MAX_PAGE_SIZE
+from models import XRate, XRateHistory, XRateRollup, ROLLUP_BUCKETS, ApiLog, ErrorLog, rates_snapshot, save_rates
 import api
+import converter
+import events
+
+
+class BadArgument(ValueError):
+    """The exception raised by controllers when a request argument is invalid, it results in 400 Bad Request."""
 
 
 class BaseController:
@@ -34,12 +46,16 @@ class BaseController:
 
     def __init__(self):
         self.request = request
+        self._snapshot = None
 
     def call(self, *args, **kwds):
         try:
             app.logger.info(f"Started {self.__class__.__name__}")
             # Actual logic, this method will be found in particular derived class-controller
             return self._call(*args, **kwds)
+        except BadArgument as ex:
+            app.logger.warning("Bad request: %s" % ex)
+            return make_response(str(ex), 400)
         except Exception as ex:
             app.logger.exception("Error: %s" % ex)
             # Return internal server error message if controller's call was unsuccessful
@@ -49,6 +65,52 @@ class BaseController:
         """An abstract method that must contain controller's particular logic realized in derived class"""
         raise NotImplementedError("_call")
 
+    def _int_arg(self, name, default=None):
+        """Utility method that returns the integer request argument
+
+        Raises:
+            BadArgument: If the argument is not an integer
+
+        """
+        value = self.request.args.get(name, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise BadArgument(f"{name} must be an integer: {value}")
+
+    def _datetime_arg(self, name):
+        """Utility method that returns the request argument in ISO 8601 format as a datetime
+
+        Raises:
+            BadArgument: If the argument is not a valid date and time
+
+        """
+        try:
+            return datetime.fromisoformat(self.request.args[name])
+        except ValueError:
+            raise BadArgument(f"{name} must be a date and time in ISO 8601 format: {self.request.args[name]}")
+
+    def _get_snapshot(self):
+        """Utility method that returns the shared snapshot of all the rates, it is taken once per request,
+        so the whole response is rendered from the same rates set without any DB access
+
+        Returns:
+            RatesSnapshot: The snapshot of the rates
+
+        """
+        if self._snapshot is None:
+            self._snapshot = rates_snapshot()
+        return self._snapshot
+
+    def _get_latest_update(self):
+        """Utility method that returns date and time of the latest update of any rate
+
+        Returns:
+            datetime: The date and time of the latest update
+
+        """
+        return self._get_snapshot().latest_update
+
     def _minutes_past_last_update(self):
         """Utility method that allows us to get the number of seconds past the latest updating of any rate
 
@@ -56,8 +118,44 @@ class BaseController:
             float: The total number of seconds past the latest update, rounded to two digits after the point
 
         """
-        latest_update = LatestUpdate.get(id=1).datetime
-        return round((datetime.now() - latest_update).total_seconds() / 60, 2)
+        return round((datetime.now() - self._get_latest_update()).total_seconds() / 60, 2)
+
+    def _conditional_response(self, etag, render, weak=False):
+        """Utility method that renders the response only if the client doesn't have its actual version yet.
+
+        The client's cached copy is validated by the ETag (If-None-Match) or, if the client hasn't sent it,
+        by the time of the latest rates update (If-Modified-Since). In that case 304 Not Modified is returned
+        without rendering anything. Every response also allows caching until the earliest possible next update
+        and contains the exact time of the latest update in the X-Latest-Update header.
+
+        Args:
+            etag (str): the entity tag, it has to change every time the rendered response changes.
+            render (callable): the function that renders the full response.
+            weak (bool): (optional) the tag is weak, it changes only when the rendered response changes
+                significantly (f.e. the HTML pages, which show the minutes past the latest update).
+
+        Returns:
+            Response: The rendered or the Not Modified response with validators and caching headers.
+
+        """
+        latest_update = self._get_latest_update()
+        last_modified = latest_update.astimezone(timezone.utc).replace(microsecond=0)
+
+        if self.request.if_none_match:
+            # If-None-Match is always compared weakly
+            not_modified = self.request.if_none_match.contains_weak(etag)
+        elif self.request.if_modified_since is not None:
+            not_modified = self.request.if_modified_since >= last_modified
+        else:
+            not_modified = False
+
+        response = make_response("", 304) if not_modified else make_response(render())
+        response.set_etag(etag, weak=weak)
+        response.last_modified = last_modified
+        response.headers["X-Latest-Update"] = latest_update.isoformat()
+        seconds_to_update = api.registry.min_refresh_interval() - (datetime.now() - latest_update).total_seconds()
+        response.cache_control.max_age = max(0, int(seconds_to_update))
+        return response
 
 
 class ViewMainPage(BaseController):
@@ -68,7 +166,10 @@ class ViewMainPage(BaseController):
     """
 
     def _call(self):
-        return render_template("index.html", title="Golden Eye", minutes=self._minutes_past_last_update())
+        minutes = self._minutes_past_last_update()
+        return self._conditional_response(str(self._get_snapshot().version),
+                                          lambda: render_template("index.html", title="Golden Eye", minutes=minutes),
+                                          weak=True)
 
 
 class ViewAllRates(BaseController):
@@ -79,64 +180,299 @@ class ViewAllRates(BaseController):
     """
 
     def _call(self):
-        xrates = XRate.select()
+        minutes = self._minutes_past_last_update()
+        return self._conditional_response(str(self._get_snapshot().version), lambda: self._render(minutes), weak=True)
+
+    def _render(self, minutes):
+        xrates = self._get_snapshot()
         return render_template("xrates.html", xrates=xrates, title="Rates", aliases_map=self.aliases_map,
-                               sources_map=self.sources_map, minutes=self._minutes_past_last_update())
+                               sources_map=self.sources_map, minutes=minutes)
 
 
 class GetApiRates(BaseController):
     """The exchange rates page controller.
 
     Provides rendering the page that contains all currencies rates combinations in the DB.
+    When the rollup argument (1h, 1d or 1w) is given, provides the OHLC rollups of the rates instead.
+
+    The rates change only when they are written by the scheduler or manually, so the serialized JSON and XML
+    responses are cached by the format and the arguments together with the version of the rates set,
+    and served directly until the version changes.
+
+    Every rate carries its update time and freshness (fresh, stale or expired, by the TTLs of its handler), and
+    the X-Rates-Age header contains the age of the oldest served rate in seconds. Stale and expired rates are
+    served as they are while they are refreshed in the background. When the max_age argument is given, the rates
+    older than max_age seconds are refreshed before the response, the failed ones are served as they are.
+
+    Attributes:
+        _cache (dict): cached responses, (fmt, args) => (version, body, content type).
 
     """
 
+    _cache = {}
+
     def _call(self, fmt):
         if not fmt:
             # Display basic page if user doesn't request specific format
-            from_currencies = XRate.select(XRate.from_currency).distinct()
-            to_currencies = XRate.select(XRate.to_currency).distinct()
+            minutes = self._minutes_past_last_update()
+            return self._conditional_response(str(self._get_snapshot().version), lambda: self._render(minutes), weak=True)
+        elif "rollup" in self.request.args:
+            app.logger.info(f"Asked for API rollups in format {fmt}")
+            version = str(self._get_snapshot().version)
+            return self._conditional_response(version, lambda: self._get_cached_rates(fmt, version))
+        else:
+            app.logger.info(f"Asked for API in format {fmt}")
+            now = datetime.now()
+            xrates = self._revalidate(self._filter_rates(self._get_snapshot()), now)
+            self._states = {(xrate.from_currency, xrate.to_currency): api.freshness(xrate, now) for xrate in xrates}
+            # Freshness of the rates is a part of the response, so it is a part of the response version
+            version = f"{self._get_snapshot().version}-{''.join(state[0] for state in self._states.values())}"
+
+            response = self._conditional_response(version, lambda: self._get_cached_rates(fmt, version))
+            if xrates:
+                response.headers["X-Rates-Age"] = str(int(max((now - xrate.updated).total_seconds()
+                                                              for xrate in xrates)))
+            return response
+
+    def _revalidate(self, xrates, now):
+        # The rates without a handler (f.e. the test ones) can't be refreshed, they are served as they are
+        refreshable = [xrate for xrate in xrates if api.registry.known(xrate.module)]
+        if "max_age" in self.request.args:
+            max_age = self._int_arg("max_age")
+            if max_age < 0:
+                raise BadArgument(f"max_age must not be negative: {max_age}")
+
+            # Rates can't be demanded fresher than their handlers may be called, so clients can't flood external APIs
+            limits = {xrate: max(max_age, api.registry.handler(xrate.module).min_refresh_interval) for xrate in refreshable}
+            outdated = [(xrate.from_currency, xrate.to_currency) for xrate in refreshable
+                        if (now - xrate.updated).total_seconds() > limits[xrate]]
+            if outdated:
+                api.refresh(outdated)
+                # Serve the rates stored by the refresh, the failed ones keep their last known values
+                self._snapshot = None
+                return self._filter_rates(self._get_snapshot())
+
+        outdated = [(xrate.from_currency, xrate.to_currency) for xrate in refreshable
+                    if api.freshness(xrate, now) != "fresh"]
+        if outdated:
+            api.revalidate(outdated)
+        return xrates
+
+    def _render(self, minutes):
+        xrates = self._get_snapshot()
+        from_currencies = {xrate.from_currency: xrate for xrate in xrates}.values()
+        to_currencies = {xrate.to_currency: xrate for xrate in xrates}.values()
+
+        return render_template("api.html", from_currencies=from_currencies, to_currencies=to_currencies,
+                               title="API", aliases_map=self.aliases_map, minutes=minutes)
+
+    def _get_cached_rates(self, fmt, version):
+        key = (fmt, tuple(sorted(self.request.args.items(multi=True))))
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return make_response(cached[1], {'Content-Type': cached[2]})
+
+        response = self._get_rates(fmt)
+
+        if len(self._cache) >= RESPONSE_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = (version, response.get_data(), response.content_type)
+        return response
 
-            return render_template("api.html", from_currencies=from_currencies, to_currencies=to_currencies,
-                                   title="API", aliases_map=self.aliases_map,
-                                   minutes=self._minutes_past_last_update())
+    def _get_rates(self, fmt):
+        if "rollup" in self.request.args:
+            # Display aggregated rates if user requests rollups
+            rollups = self._filter_rollups(self._filter(XRateRollup.select(), XRateRollup))
+            root, item, rows = "rollups", "rollup", self._rollup_rows(rollups)
         else:
             # Display rate(s) if user requests specific format
-            xrates = XRate.select()
+            xrates = self._filter_rates(self._get_snapshot())
+            root, item, rows = "xrates", "xrate", self._rate_rows(xrates)
 
-            app.logger.info(f"Asked for API in format {fmt}")
-            xrates = self._filter(xrates)
-
-            if fmt == "json":
-                return self._get_json(xrates)
-            elif fmt == "xml":
-                return self._get_xml(xrates)
-            raise ValueError(f"Unknown fmt: {fmt}")
+        if fmt == "json":
+            return self._get_json(rows)
+        elif fmt == "xml":
+            return self._get_xml(root, item, rows)
+        raise ValueError(f"Unknown fmt: {fmt}")
 
-    def _filter(self, xrates):
+    def _filter(self, xrates, model):
         args = self.request.args
 
         if "from_currency" in args:
-            xrates = xrates.where(XRate.from_currency == args["from_currency"])
+            xrates = xrates.where(model.from_currency == self._int_arg("from_currency"))
 
         if "to_currency" in args:
-            xrates = xrates.where(XRate.to_currency == args.get("to_currency"))
+            xrates = xrates.where(model.to_currency == self._int_arg("to_currency"))
 
         return xrates
 
-    def _get_xml(self, xrates):
-        d = {"xrates": {"xrate": [
-            {"alias": f'{self.aliases_map[rate.from_currency][0]}-{self.aliases_map[rate.to_currency][0]}',
-             "from": rate.from_currency,
-             "to": rate.to_currency,
-             "rate": rate.rate} for rate in xrates]}}
+    def _filter_rates(self, xrates):
+        args = self.request.args
+        from_currency = self._int_arg("from_currency") if "from_currency" in args else None
+        to_currency = self._int_arg("to_currency") if "to_currency" in args else None
+        return [xrate for xrate in xrates
+                if from_currency in (None, xrate.from_currency) and to_currency in (None, xrate.to_currency)]
+
+    def _filter_rollups(self, rollups):
+        args = self.request.args
+
+        if args["rollup"] not in ROLLUP_BUCKETS:
+            raise BadArgument(f"Unknown rollup: {args['rollup']}")
+        rollups = rollups.where(XRateRollup.bucket == args["rollup"])
+
+        if "start" in args:
+            rollups = rollups.where(XRateRollup.start >= self._datetime_arg("start"))
+
+        if "end" in args:
+            rollups = rollups.where(XRateRollup.start < self._datetime_arg("end"))
+
+        limit = self._int_arg("limit", HISTORY_LIMIT)
+        if not 0 < limit <= HISTORY_MAX_LIMIT:
+            raise BadArgument(f"Limit must be between 1 and {HISTORY_MAX_LIMIT}: {limit}")
+
+        return rollups.order_by(XRateRollup.start, XRateRollup.from_currency, XRateRollup.to_currency).limit(limit)
+
+    def _alias(self, rate):
+        # Pairs created from bulk handlers' responses could have currencies without aliases
+        from_alias = self.aliases_map.get(rate.from_currency, (str(rate.from_currency),))[0]
+        to_alias = self.aliases_map.get(rate.to_currency, (str(rate.to_currency),))[0]
+        return f'{from_alias}-{to_alias}'
+
+    def _rate_rows(self, xrates):
+        return [{"alias": self._alias(rate),
+                 "from": rate.from_currency,
+                 "to": rate.to_currency,
+                 "rate": rate.rate,
+                 "updated": rate.updated.isoformat(),
+                 "freshness": self._states[(rate.from_currency, rate.to_currency)]} for rate in xrates]
+
+    def _rollup_rows(self, rollups):
+        return [{"alias": self._alias(rollup),
+                 "from": rollup.from_currency,
+                 "to": rollup.to_currency,
+                 "bucket": rollup.bucket,
+                 "start": rollup.start.isoformat(),
+                 "open": rollup.open,
+                 "high": rollup.high,
+                 "low": rollup.low,
+                 "close": rollup.close,
+                 "average": rollup.average,
+                 "samples": rollup.samples} for rollup in rollups]
+
+    def _get_xml(self, root, item, rows):
+        d = {root: {item: rows}}
         return make_response(xmltodict.unparse(d), {'Content-Type': 'text/xml'})
 
-    def _get_json(self, xrates):
-        return jsonify([{"alias": f'{self.aliases_map[rate.from_currency][0]}-{self.aliases_map[rate.to_currency][0]}',
-                         "from": rate.from_currency,
-                         "to": rate.to_currency,
-                         "rate": rate.rate} for rate in xrates])
+    def _get_json(self, rows):
+        return jsonify(rows)
+
+
+class StreamRates(BaseController):
+    """The exchange rates changes stream controller.
+
+    Provides Server-Sent Events with the changed rates, optionally filtered by currencies. The first event contains
+    all the current rates, so the client doesn't need to poll the rates API at all. Every event id is the version
+    of the rates set.
+
+    """
+
+    def _call(self):
+        args = self.request.args
+        from_currency = self._int_arg("from_currency") if "from_currency" in args else None
+        to_currency = self._int_arg("to_currency") if "to_currency" in args else None
+
+        subscription = events.broker.subscribe(from_currency, to_currency)
+        return Response(subscription.stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class GetRatesHistory(BaseController):
+    """The exchange rates history API controller.
+
+    Provides the historical values of exchange rates in JSON, optionally filtered by currencies and a time range.
+    The results are ordered by time and paginated with a cursor (the time and the id of the last returned entity),
+    so every page is a bounded range scan of the composite index instead of an offset over all the previous rows.
+
+    """
+
+    def _call(self):
+        args = self.request.args
+        history = XRateHistory.select().order_by(XRateHistory.created, XRateHistory.id)
+
+        if "from_currency" in args:
+            history = history.where(XRateHistory.from_currency == self._int_arg("from_currency"))
+
+        if "to_currency" in args:
+            history = history.where(XRateHistory.to_currency == self._int_arg("to_currency"))
+
+        if "start" in args:
+            history = history.where(XRateHistory.created >= self._datetime_arg("start"))
+
+        if "end" in args:
+            history = history.where(XRateHistory.created < self._datetime_arg("end"))
+
+        if "cursor" in args:
+            cursor = Tuple(*self._parse_cursor(args["cursor"]))
+            history = history.where(Tuple(XRateHistory.created, XRateHistory.id) > cursor)
+
+        limit = self._int_arg("limit", HISTORY_LIMIT)
+        if not 0 < limit <= HISTORY_MAX_LIMIT:
+            raise BadArgument(f"Limit must be between 1 and {HISTORY_MAX_LIMIT}: {limit}")
+
+        rates = list(history.limit(limit))
+        next_cursor = f"{rates[-1].created.isoformat()},{rates[-1].id}" if len(rates) == limit else None
+
+        return jsonify({"history": [{"from": rate.from_currency,
+                                     "to": rate.to_currency,
+                                     "rate": rate.rate,
+                                     "created": rate.created.isoformat(),
+                                     "module": rate.module} for rate in rates],
+                        "next_cursor": next_cursor})
+
+    @staticmethod
+    def _parse_cursor(cursor):
+        # The cursor is the time and the id of the last returned entity
+        created, _, xrate_id = cursor.rpartition(",")
+        try:
+            return datetime.fromisoformat(created), int(xrate_id)
+        except ValueError:
+            raise BadArgument(f"Invalid cursor: {cursor}")
+
+
+class ConvertCurrency(BaseController):
+    """The currency conversion API controller.
+
+    Provides conversion of an amount between any two currencies, even if their rate is not stored directly,
+    through a chain of the stored rates and their inverse values. The result contains the used rates.
+    If the currencies can't be converted with the stored rates, 404 Not Found is returned.
+
+    """
+
+    def _call(self):
+        from_currency = self._int_arg("from")
+        to_currency = self._int_arg("to")
+        try:
+            amount = float(self.request.args.get("amount", 1))
+        except ValueError:
+            raise BadArgument(f"amount must be a number: {self.request.args['amount']}")
+
+        version = str(self._get_snapshot().version)
+        try:
+            conversion = converter.get_graph().convert(from_currency, to_currency, amount)
+        except ValueError as ex:
+            app.logger.warning("Not found: %s" % ex)
+            return make_response(str(ex), 404)
+        return self._conditional_response(version, lambda: self._render(from_currency, to_currency, amount, conversion))
+
+    def _render(self, from_currency, to_currency, amount, conversion):
+        result, rate, path = conversion
+        return jsonify({"from": from_currency,
+                        "to": to_currency,
+                        "amount": amount,
+                        "rate": rate,
+                        "result": result,
+                        "path": [{"from": edge_from, "to": edge_to, "rate": edge_rate, "inverse": inverse}
+                                 for edge_from, edge_to, edge_rate, inverse in path]})
 
 
 class UpdateRates(BaseController):
@@ -156,42 +492,110 @@ class UpdateRates(BaseController):
         api.update_rate(from_currency, to_currency)
 
     def _update_all(self):
-        xrates = XRate.select()
-        for rate in xrates:
-            try:
-                self._update_rate(rate.from_currency, rate.to_currency)
-            except Exception as ex:
-                app.logger.exception("Error: %s" % ex)
-                print(ex)
+        outcomes = api.update_rates()
+        for ex in outcomes.values():
+            if ex is not None:
+                app.logger.error("Error: %s" % ex, exc_info=ex)
 
 
 class ViewLogs(BaseController):
+    """The logs page controller.
+
+    Provides one page of external API calls or errors logs, in HTML or JSON. Pages are selected by a cursor
+    (the "cursor" argument, the next page cursor is returned in the X-Next-Cursor header for JSON),
+    with a configurable size (the "limit" argument).
+
+    """
+
+    logs_models = {'api': ApiLog, 'errors': ErrorLog}
+
     def _call(self, logs_type, fmt):
         app.logger.debug("log_type: %s" % logs_type)
-        page = int(self.request.args.get("page", 1))
-        page = 1 if page == 0 else page
+        model = self._get_model(logs_type)
+        cursor = self._check_cursor(self.request.args.get("cursor"))
+        size = self._int_arg("limit", LOGS_PAGE_SIZE)
 
-        if page < 0:
-            app.logger.exception("Error: %s" % f"Page number must be greater than zero: {logs_type}")
-            raise ValueError(f"Page number must be greater than zero: {logs_type}")
+        if not 0 < size <= LOGS_MAX_PAGE_SIZE:
+            raise BadArgument(f"Limit must be between 1 and {LOGS_MAX_PAGE_SIZE}: {size}")
 
-        models = {'api': ApiLog, 'errors': ErrorLog}
-        if logs_type not in models:
-            app.logger.exception("Error: %s" % f"Unknown logs type: {logs_type}")
-            raise ValueError(f"Unknown logs type: {logs_type}")
-
-        logs = models[logs_type].select().paginate(page, 10).order_by(models[logs_type].id.desc())
+        logs, next_cursor = model.select_page(cursor, size)
+        # Load lazy fields (f.e. compressed response texts) only for the logs on the displayed page
+        model.load_logs(logs)
+        jsons = [log.json() for log in logs]
         title = "API logs" if logs_type == "api" else "Error logs"
 
         if fmt == "json":
-            return jsonify([log.json() for log in logs])
+            response = jsonify(jsons)
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+            return response
         elif fmt == 'html':
-            return render_template("logs.html", jsons=jsonify([log.json() for log in logs]), logs_len=len(logs),
-                                   title=title, page_number=page, logs_type=logs_type)
+            return render_template("logs.html", jsons=jsons, logs_len=len(logs), title=title, first_page=not cursor,
+                                   next_cursor=next_cursor, page_size=size, logs_type=logs_type)
         else:
             app.logger.exception("Error: %s" % f"Unknown format: {fmt}")
             raise ValueError(f"Unknown format: {fmt}")
 
+    @staticmethod
+    def _check_cursor(cursor):
+        # The cursor is the partition (empty for the base table) and the id of the last log of the previous page
+        if cursor:
+            _, separator, log_id = cursor.partition(":")
+            if not separator or not log_id.isdigit():
+                raise BadArgument(f"Invalid cursor: {cursor}")
+        return cursor
+
+    def _get_model(self, logs_type):
+        if logs_type not in self.logs_models:
+            app.logger.exception("Error: %s" % f"Unknown logs type: {logs_type}")
+            raise ValueError(f"Unknown logs type: {logs_type}")
+        return self.logs_models[logs_type]
+
+
+class ExportLogs(ViewLogs):
+    """The logs export controller.
+
+    Provides all external API calls or errors logs as a stream of NDJSON or CSV lines. The logs are read
+    by chunks of constant size and sent as soon as they are read, so the memory usage doesn't depend
+    on the number of logs.
+
+    """
+
+    def _call(self, logs_type, fmt):
+        model = self._get_model(logs_type)
+
+        if fmt == "ndjson":
+            lines, mimetype = self._ndjson(model), "application/x-ndjson"
+        elif fmt == "csv":
+            lines, mimetype = self._csv(model), "text/csv"
+        else:
+            app.logger.exception("Error: %s" % f"Unknown format: {fmt}")
+            raise ValueError(f"Unknown format: {fmt}")
+
+        return Response(stream_with_context(lines), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={logs_type}_logs.{fmt}"})
+
+    def _chunks(self, model):
+        for logs in model.iterate():
+            model.load_logs(logs)
+            yield logs
+
+    def _ndjson(self, model):
+        for logs in self._chunks(model):
+            yield "".join(json.dumps(log.json(), default=str) + "\n" for log in logs)
+
+    def _csv(self, model):
+        fields = model._meta.sorted_field_names
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        for logs in self._chunks(model):
+            writer.writerows([getattr(log, field) for field in fields] for log in logs)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
 
 class EditRate(BaseController):
     """Manual rate edit page controller.
@@ -226,9 +630,10 @@ class EditRate(BaseController):
             app.logger.exception("Error: %s" % "new_rate must be not empty")
             raise Exception("new_rate must be not empty")
 
-        (XRate.update({XRate.rate: float(request.form["new_rate"]), XRate.updated: datetime.now()})
-         .where(XRate.from_currency == from_currency,
-                XRate.to_currency == to_currency).execute())
+        # The edit is stored like the fetched rates, so it gets into the history and rollups too
+        xrate = XRate.get(XRate.from_currency == from_currency, XRate.to_currency == to_currency)
+        xrate.rate, xrate.updated = float(request.form["new_rate"]), datetime.now()
+        save_rates([xrate])
 
         # print("upd_count", upd_count)
         # After successful editing return the user to the page that contains all exchange rates
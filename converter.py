@@ -0,0 +1,82 @@
+"""This module contains the engine of currency conversion through the graph of known exchange rates."""
+
+import threading
+from collections import deque
+
+from models import rates_snapshot
+
+
+class CurrencyGraph:
+    """The class that describes all currencies as a graph where exchange rates are the edges.
+
+    Every stored rate gives two edges: the direct one and the inverse one (1 / rate), so any currency can be
+    converted to any other one that is reachable through a chain of rates, f.e. UAH to RUB through USD.
+    The best (shortest) chains between all the pairs are precomputed once with a BFS from every currency,
+    therefore a conversion is a simple dict lookup. Direct rates are preferred over inverse ones.
+
+    Attributes:
+        paths (dict): (from_currency, to_currency) => (rate, path), where path is a list of the used edges,
+            (from_currency, to_currency, rate, inverse).
+
+    """
+
+    def __init__(self, xrates):
+        # Rates which are not positive (f.e. not fetched yet or edited by mistake) can't be used for conversion
+        xrates = [xrate for xrate in xrates if xrate.rate > 0]
+        edges = {}
+        for xrate in xrates:
+            edges.setdefault(xrate.from_currency, {})[xrate.to_currency] = (xrate.rate, False)
+        for xrate in xrates:
+            edges.setdefault(xrate.to_currency, {}).setdefault(xrate.from_currency, (1 / xrate.rate, True))
+
+        self.paths = {}
+        for source in edges:
+            self._find_paths(source, edges)
+
+    def _find_paths(self, source, edges):
+        self.paths[(source, source)] = (1.0, [])
+        queue = deque([source])
+        while queue:
+            currency = queue.popleft()
+            rate, path = self.paths[(source, currency)]
+            for target, (edge_rate, inverse) in edges[currency].items():
+                if (source, target) not in self.paths:
+                    self.paths[(source, target)] = (rate * edge_rate, path + [(currency, target, edge_rate, inverse)])
+                    queue.append(target)
+
+    def convert(self, from_currency, to_currency, amount=1.0):
+        """Convert the amount of one currency to another one.
+
+        Args:
+            from_currency (int): the international digital code of the currency to be exchanged from.
+            to_currency (int): the international digital code of the currency to be exchanged to.
+            amount (float): (optional) the amount of the currency to be exchanged from.
+
+        Returns:
+            tuple: The converted amount, the resulting rate and the path of the used rates.
+
+        """
+        if (from_currency, to_currency) not in self.paths:
+            raise ValueError(f"Unknown currencies combination: {from_currency}=>{to_currency}")
+
+        rate, path = self.paths[(from_currency, to_currency)]
+        return amount * rate, rate, path
+
+
+_lock = threading.Lock()
+_graph = (None, None)
+
+
+def get_graph():
+    """Return the currency graph of the current rates, it is rebuilt only when the rates set version changes.
+
+    Returns:
+        CurrencyGraph: The graph of the current rates.
+
+    """
+    global _graph
+    xrates = rates_snapshot()
+    with _lock:
+        if _graph[0] != xrates.version:
+            _graph = (xrates.version, CurrencyGraph(list(xrates)))
+        return _graph[1]
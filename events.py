@@ -0,0 +1,210 @@
+"""This module contains the broker of rates change events streamed to clients with Server-Sent Events."""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import snapshot
+from config import logging, EVENTS_POLL_INTERVAL, EVENTS_HEARTBEAT_INTERVAL, EVENTS_QUEUE_SIZE
+
+# The marker that closes a subscription
+_CLOSE = object()
+
+
+class Subscription:
+    """The class that represents one client subscribed to rates changes, optionally of one pair only.
+
+    Attributes:
+        from_currency (int): the code of base currency of the rates, all of them if None.
+        to_currency (int): the code of target currency of the rates, all of them if None.
+
+    """
+
+    def __init__(self, broker, from_currency=None, to_currency=None, queue_size=EVENTS_QUEUE_SIZE):
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+        self._broker = broker
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def matches(self, xrate):
+        """Check whether the rate is subscribed to."""
+        from_matches = self.from_currency in (None, xrate.from_currency)
+        return from_matches and self.to_currency in (None, xrate.to_currency)
+
+    def stream(self, heartbeat_interval=EVENTS_HEARTBEAT_INTERVAL):
+        """Generate the Server-Sent Events of the subscription, until the client disconnects.
+
+        The first event contains all the current subscribed rates, the next ones contain only the changed rates.
+        When nothing happens a comment line is sent periodically to keep the connection alive.
+
+        Args:
+            heartbeat_interval (float): (optional) the maximum number of seconds between two messages.
+
+        Yields:
+            str: The messages of the event stream.
+
+        """
+        try:
+            current = self._broker.current()
+            if current is not None:
+                yield self._broker.event(current.version, [xrate for xrate in current if self.matches(xrate)])
+            while True:
+                try:
+                    message = self._queue.get(timeout=heartbeat_interval)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message is _CLOSE:
+                    return
+                yield message
+        finally:
+            self._broker.unsubscribe(self)
+
+    def push(self, message):
+        """Queue the event message, the subscription is closed if its queue is full."""
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # The client doesn't keep up with the events, it will get all the rates again on reconnection
+            self._broker.unsubscribe(self)
+            self.close()
+
+    def close(self):
+        """Stop the stream of the subscription."""
+        while True:
+            try:
+                self._queue.put_nowait(_CLOSE)
+                return
+            except queue.Full:
+                # Undelivered events are useless for a closed stream
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class RatesBroker:
+    """The class that fans out rates changes to all the subscribed clients of the process.
+
+    Rates are written by another process (usually the scheduler), so one watcher thread per process checks
+    the published rates snapshot for a new version. Checking is a single file stat, and it doesn't depend
+    on the number of subscribers. When the version changes, the changed rates are found once, every distinct
+    filter is serialized once, and the messages are put into the subscribers' bounded queues without waiting,
+    so thousands of idle clients cost only their queues and a slow client never delays the others.
+
+    Attributes:
+        poll_interval (float): the number of seconds between two checks of the snapshot.
+
+    """
+
+    def __init__(self, poll_interval=EVENTS_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.log = logging.getLogger("Events")
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._snapshot = None
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, from_currency=None, to_currency=None):
+        """Subscribe to the rates changes.
+
+        Args:
+            from_currency (int): (optional) the code of base currency of the rates, all of them by default.
+            to_currency (int): (optional) the code of target currency of the rates, all of them by default.
+
+        Returns:
+            Subscription: The subscription, its stream() generates the events.
+
+        """
+        self._start()
+        subscription = Subscription(self, from_currency, to_currency)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop sending events to the subscription."""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def current(self):
+        """Return the rates snapshot the subscribers got the latest events about."""
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = snapshot.current()
+            return self._snapshot
+
+    def check(self):
+        """Send the rates changed since the previous check to the subscribers.
+
+        Returns:
+            int: The number of changed rates.
+
+        """
+        previous = self.current()
+        current = snapshot.current()
+        if current is None or (previous is not None and current.version == previous.version):
+            return 0
+
+        # The rates refreshed without changes are not sent, only their update times differ
+        old = {(xrate.from_currency, xrate.to_currency): xrate.rate for xrate in previous or ()}
+        changed = [xrate for xrate in current if old.get((xrate.from_currency, xrate.to_currency)) != xrate.rate]
+        with self._lock:
+            self._snapshot = current
+            subscribers = list(self._subscribers)
+
+        messages = {}
+        for subscription in subscribers:
+            key = (subscription.from_currency, subscription.to_currency)
+            if key not in messages:
+                xrates = [xrate for xrate in changed if subscription.matches(xrate)]
+                messages[key] = self.event(current.version, xrates) if xrates else None
+            if messages[key] is not None:
+                subscription.push(messages[key])
+        return len(changed)
+
+    @staticmethod
+    def event(version, xrates):
+        """Serialize the rates to an event message.
+
+        Args:
+            version (int): the version of the rates set, it is the event id.
+            xrates (list): the rates of the event.
+
+        Returns:
+            str: The message of the event stream.
+
+        """
+        data = json.dumps([{"from": xrate.from_currency,
+                            "to": xrate.to_currency,
+                            "rate": xrate.rate,
+                            "updated": xrate.updated.isoformat()} for xrate in xrates])
+        return f"id: {version}\nevent: rates\ndata: {data}\n\n"
+
+    def _running(self):
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def _start(self):
+        # The watcher thread is not inherited by forked processes (f.e. gunicorn workers), so it is started per process
+        if self._running():
+            return
+        with self._lock:
+            if not self._running():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="RatesBroker", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.check()
+            except Exception:
+                self.log.exception("Error during rates changes check")
+
+
+# The broker shared by all the event streams of the process
+broker = RatesBroker()
@@ -1,35 +1,66 @@
 """This module contains all app's database models."""
 
+import hashlib
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
 import config
+import snapshot
 from config import DB_CONN
 from peewee import SqliteDatabase, Model, IntegerField, DoubleField, DateTimeField, datetime as peewee_datetime, \
-    CharField, TextField, PostgresqlDatabase
+    CharField, TextField, chunked, Case, EXCLUDED, BlobField
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledPostgresqlDatabase, PooledSqliteDatabase
 
-# Initialize an app's DB
+# Initialize an app's DB. Connections are pooled per process and are opened and closed explicitly around
+# every web request and scheduled job (see db_connection), so a closed connection returns to the pool
+# instead of being dropped
 if DB_CONN['host'] and DB_CONN['user'] and DB_CONN['password'] and \
         DB_CONN['port'] and DB_CONN['database'] and DB_CONN['sslmode']:
-    db = PostgresqlDatabase(host=DB_CONN['host'],
-                            user=DB_CONN['user'],
-                            password=DB_CONN['password'],
-                            port=DB_CONN['port'],
-                            database=DB_CONN['database'],
-                            sslmode=DB_CONN['sslmode'])
+    db = PooledPostgresqlDatabase(host=DB_CONN['host'],
+                                  user=DB_CONN['user'],
+                                  password=DB_CONN['password'],
+                                  port=DB_CONN['port'],
+                                  database=DB_CONN['database'],
+                                  sslmode=DB_CONN['sslmode'],
+                                  max_connections=config.DB_MAX_CONNECTIONS,
+                                  stale_timeout=config.DB_STALE_TIMEOUT,
+                                  timeout=config.DB_POOL_TIMEOUT)
 else:
     # If PostgreSQL connection cannot be established init SQLlite DB
-    db = SqliteDatabase(config.DB_PATH)
+    db = PooledSqliteDatabase(config.DB_PATH,
+                              max_connections=config.DB_MAX_CONNECTIONS,
+                              stale_timeout=config.DB_STALE_TIMEOUT,
+                              timeout=config.DB_POOL_TIMEOUT,
+                              check_same_thread=False,
+                              pragmas=config.SQLITE_PRAGMAS)
 
 # Initialize separated DB for API logs
 if DB_CONN['host'] and DB_CONN['user'] and DB_CONN['password'] and \
         DB_CONN['port'] and DB_CONN['database_logs'] and DB_CONN['sslmode']:
-    db_logs = PostgresqlDatabase(host=DB_CONN['host'],
-                                 user=DB_CONN['user'],
-                                 password=DB_CONN['password'],
-                                 port=DB_CONN['port'],
-                                 database=DB_CONN['database_logs'],
-                                 sslmode=DB_CONN['sslmode'])
+    db_logs = PooledPostgresqlDatabase(host=DB_CONN['host'],
+                                       user=DB_CONN['user'],
+                                       password=DB_CONN['password'],
+                                       port=DB_CONN['port'],
+                                       database=DB_CONN['database_logs'],
+                                       sslmode=DB_CONN['sslmode'],
+                                       max_connections=config.DB_MAX_CONNECTIONS,
+                                       stale_timeout=config.DB_STALE_TIMEOUT,
+                                       timeout=config.DB_POOL_TIMEOUT)
 else:
     # If PostgreSQL connection cannot be established init SQLlite DB
-    db_logs = SqliteDatabase(config.LOGS_DB_PATH)
+    db_logs = PooledSqliteDatabase(config.LOGS_DB_PATH,
+                                   max_connections=config.DB_MAX_CONNECTIONS,
+                                   stale_timeout=config.DB_STALE_TIMEOUT,
+                                   timeout=config.DB_POOL_TIMEOUT,
+                                   check_same_thread=False,
+                                   pragmas=config.SQLITE_PRAGMAS)
+
+# Writers of every DB within the process, see write_transaction
+_write_locks = {db: threading.RLock(), db_logs: threading.RLock()}
 
 
 # if os.environ.get("DATABASE_URL"):
@@ -44,6 +75,47 @@ else:
 #     db = SqliteDatabase(config.DB_PATH)
 
 
+@contextmanager
+def db_connection():
+    """This context manager takes connections to both the app's DB and the logs DB from the pools and returns
+    them on exit. Connections that are already open in the current thread are reused and returned as well.
+    """
+    db.connect(reuse_if_open=True)
+    db_logs.connect(reuse_if_open=True)
+    try:
+        yield
+    finally:
+        close_db()
+
+
+@contextmanager
+def write_transaction(database=db):
+    """This context manager runs a write transaction in the given DB.
+
+    On SQLite all the writes of the process are serialized by one lock, and the transaction takes the DB file
+    write lock at its start (BEGIN IMMEDIATE) instead of upgrading a read lock in the middle of it. So writers
+    of different processes queue up within busy_timeout instead of failing with "database is locked",
+    and in WAL mode readers are never blocked by them. Nested transactions become savepoints.
+
+    Args:
+        database (Database): (optional) the DB to write to, the app's DB by default.
+
+    """
+    if isinstance(database, SqliteDatabase):
+        with _write_locks[database], database.atomic(lock_type="IMMEDIATE"):
+            yield
+    else:
+        with database.atomic():
+            yield
+
+
+def close_db():
+    """This function returns connections of the current thread to the pools, if they are open."""
+    for database in (db, db_logs):
+        if not database.is_closed():
+            database.close()
+
+
 class _Model(Model):
     """The internal base class for DB model description.
 
@@ -88,6 +160,200 @@ class _LogModel(Model):
         data = self.__data__
         return data
 
+    @classmethod
+    def insert_logs(cls, rows):
+        """This method writes many log entities at once with bulk inserts.
+
+        Args:
+            rows (list): dicts with the values of the entities fields.
+
+        """
+        for batch in chunked(rows, 50):
+            cls.insert_many(batch).execute()
+
+    @classmethod
+    def load_logs(cls, logs):
+        """This method prepares already fetched log entities for displaying, f.e. loads their lazy fields.
+
+        Args:
+            logs (list): the log entities.
+
+        """
+
+
+class _PartitionedLogModel(_LogModel):
+    """The internal base class for DB Log models which entities are partitioned by weeks.
+
+    Every week's entities are stored in a separate table named like "api_logs_2022w30", so the logs retention
+    is done by dropping whole tables of old weeks, which is fast and doesn't block writing to the current week.
+    The table of the base model itself (f.e. "api_logs") keeps the entities written before partitioning
+    and is treated as the oldest partition.
+
+    Partition models are subclasses of the base model bound to the partition tables, they are created
+    on demand together with their tables.
+
+    Attributes:
+        partition_key (str): the ISO year and week of the partition, None for the base model.
+
+    """
+
+    partition_key = None
+    _partitions = {}
+
+    @classmethod
+    def partition(cls, time=None):
+        """This method returns the partition model for the given date and time.
+
+        Args:
+            time (datetime): (optional) date and time, now by default.
+
+        Returns:
+            The partition model.
+
+        """
+        time = time or peewee_datetime.datetime.now()
+        return cls._partition(f"{time:%G}w{time:%V}")
+
+    @classmethod
+    def _partition(cls, key):
+        base = cls._base()
+        table_name = f"{base._meta.table_name}_{key}"
+        model = cls._partitions.get(table_name)
+        if model is None:
+            meta = type("Meta", (), {"table_name": table_name})
+            attrs = {"Meta": meta, "partition_key": key, "__module__": base.__module__}
+            model = type(f"{base.__name__}_{key}", (base,), attrs)
+            model.create_table(safe=True)
+            cls._partitions[table_name] = model
+        return model
+
+    @classmethod
+    def _base(cls):
+        return cls.__mro__[1] if cls.partition_key else cls
+
+    @classmethod
+    def partitions(cls):
+        """This method returns the models of all the existing partitions.
+
+        Returns:
+            list: The partition models, from the newest one to the oldest one, the base model is the last one.
+
+        """
+        base = cls._base()
+        pattern = re.compile(rf"^{base._meta.table_name}_(\d{{4}}w\d{{2}})$")
+        keys = sorted((match.group(1) for match in map(pattern.match, base._meta.database.get_tables()) if match),
+                      reverse=True)
+        return [base._partition(key) for key in keys] + [base]
+
+    @classmethod
+    def drop_partitions(cls, before):
+        """This method drops the partitions of the weeks that are completely over before the given date and time.
+
+        The base model table is emptied when its latest entity is older than the given date and time.
+
+        Args:
+            before (datetime): date and time of the oldest entity to keep.
+
+        Returns:
+            list: The names of dropped tables.
+
+        """
+        dropped = []
+        for model in cls.partitions():
+            if model.partition_key:
+                week_end = peewee_datetime.datetime.strptime(f"{model.partition_key}1", "%Gw%V%u") + \
+                    peewee_datetime.timedelta(weeks=1)
+                if week_end <= before:
+                    model.drop_table()
+                    cls._partitions.pop(model._meta.table_name, None)
+                    dropped.append(model._meta.table_name)
+            elif model.table_exists() and model.select().where(model.created >= before).count() == 0:
+                model.drop_table()
+                model.create_table()
+                dropped.append(model._meta.table_name)
+        return dropped
+
+    @classmethod
+    def insert_logs(cls, rows):
+        """This method writes many log entities at once with bulk inserts into the partitions of their weeks.
+
+        Args:
+            rows (list): dicts with the values of the entities fields.
+
+        """
+        partitions = {}
+        for row in rows:
+            row.setdefault("created", peewee_datetime.datetime.now())
+            partitions.setdefault(cls.partition(row["created"]), []).append(row)
+
+        for model, partition_rows in partitions.items():
+            for batch in chunked(partition_rows, 50):
+                model.insert_many(batch).execute()
+
+    @classmethod
+    def select_page(cls, cursor=None, size=10):
+        """This method returns one page of the latest entities from all the partitions.
+
+        Pages are selected by a cursor - the partition and the id of the last entity of the previous page,
+        so every page is an index range scan that doesn't depend on how deep the page is.
+
+        Args:
+            cursor (str): (optional) the cursor returned with the previous page, the first page by default.
+            size (int): (optional) the number of entities per page.
+
+        Returns:
+            tuple: The log entities, the latest ones first, and the cursor of the next page (None for the last one).
+
+        """
+        logs = []
+        for model, query in cls._select_after(cursor):
+            logs.extend(query.limit(size - len(logs)))
+            if len(logs) == size:
+                break
+
+        next_cursor = f"{logs[-1].partition_key or ''}:{logs[-1].id}" if len(logs) == size else None
+        return logs, next_cursor
+
+    @classmethod
+    def iterate(cls, chunk_size=1000):
+        """This method iterates over all the entities of all the partitions, the latest ones first.
+
+        Entities are read by chunks with the same cursors as pages, so the memory usage doesn't depend
+        on the number of entities.
+
+        Args:
+            chunk_size (int): (optional) the number of entities read with one query.
+
+        Yields:
+            list: The chunks of log entities.
+
+        """
+        cursor = None
+        while True:
+            logs, cursor = cls.select_page(cursor, chunk_size)
+            if logs:
+                yield logs
+            if cursor is None:
+                return
+
+    @classmethod
+    def _select_after(cls, cursor):
+        """Yield the partitions starting from the one of the cursor with the queries of their entities after it."""
+        key, log_id = None, None
+        if cursor:
+            key, _, log_id = cursor.partition(":")
+            key, log_id = key or None, int(log_id)
+
+        for model in cls.partitions():
+            query = model.select().order_by(model.id.desc())
+            if cursor:
+                # Partitions newer than the cursor ones are already passed, the base model is the oldest one
+                if model.partition_key and (key is None or model.partition_key > key):
+                    continue
+                if model.partition_key == key:
+                    query = query.where(model.id < log_id)
+            yield model, query
+
 
 class XRate(_Model):
     """The class that represents an exchange rate entity in the DB.
@@ -101,6 +367,8 @@ class XRate(_Model):
         rate (DoubleField): an exchange rate.
         updated (DateTimeField): date and time of the last update.
         module (CharField): a name of the module that handle the data retrieving form an external API.
+        refresh_interval (IntegerField): (optional) the base refresh interval of the rate in seconds,
+            the interval of the module's handler is used if it is not set.
 
     """
     class Meta:
@@ -121,11 +389,110 @@ class XRate(_Model):
     rate = DoubleField()
     updated = DateTimeField(default=peewee_datetime.datetime.now)
     module = CharField(max_length=100)
+    refresh_interval = IntegerField(null=True)
 
     def __str__(self):
         return "XRate(%s=>%s): %s" % (self.from_currency, self.to_currency, self.rate)
 
 
+class XRateHistory(_Model):
+    """The class that represents a historical value of an exchange rate in the DB.
+
+    Unlike XRate, which keeps only the current value, this table is append-only: every update
+    of a rate adds a new entity, so the rates can be charted or audited later.
+
+    Attributes:
+        from_currency (IntegerField): an international code of base currency.
+        to_currency (IntegerField): an international code of target currency.
+        rate (DoubleField): an exchange rate.
+        created (DateTimeField): date and time of the update.
+        module (CharField): a name of the module that retrieved the rate form an external API.
+
+    """
+    class Meta:
+        """The nested class for XRateHistory Model Class for table specifying.
+
+        Attributes:
+            db_table (str): the name of the corresponding table in the DB.
+            indexes (tuple): table indexes, the composite one serves time range queries of a pair.
+
+        """
+        db_table = "xrates_history"
+        indexes = (
+            (("from_currency", "to_currency", "created"), False),
+        )
+
+    from_currency = IntegerField()
+    to_currency = IntegerField()
+    rate = DoubleField()
+    created = DateTimeField(default=peewee_datetime.datetime.now)
+    module = CharField(max_length=100)
+
+    def __str__(self):
+        return "XRateHistory(%s=>%s): %s at %s" % (self.from_currency, self.to_currency, self.rate, self.created)
+
+
+class XRateRollup(_Model):
+    """The class that represents an aggregated (OHLC) value of an exchange rate during a period of time.
+
+    Rollups are kept for every rate at several bucket sizes (see ROLLUP_BUCKETS) and are updated incrementally
+    every time new rates are stored, so charts for days and weeks don't need to scan the raw history.
+
+    Attributes:
+        from_currency (IntegerField): an international code of base currency.
+        to_currency (IntegerField): an international code of target currency.
+        bucket (CharField): the bucket size - 1h, 1d or 1w.
+        start (DateTimeField): date and time of the bucket beginning.
+        open (DoubleField): the first rate in the bucket.
+        high (DoubleField): the highest rate in the bucket.
+        low (DoubleField): the lowest rate in the bucket.
+        close (DoubleField): the latest rate in the bucket.
+        total (DoubleField): the sum of all rates in the bucket, to calculate the average.
+        samples (IntegerField): the number of rates in the bucket.
+
+    """
+    class Meta:
+        """The nested class for XRateRollup Model Class for table specifying.
+
+        Attributes:
+            db_table (str): the name of the corresponding table in the DB.
+            indexes (tuple): table indexes.
+
+        """
+        db_table = "xrates_rollups"
+        indexes = (
+            (("from_currency", "to_currency", "bucket", "start"), True),
+        )
+
+    from_currency = IntegerField()
+    to_currency = IntegerField()
+    bucket = CharField(max_length=2)
+    start = DateTimeField()
+    open = DoubleField()
+    high = DoubleField()
+    low = DoubleField()
+    close = DoubleField()
+    total = DoubleField()
+    samples = IntegerField()
+
+    @property
+    def average(self):
+        return self.total / self.samples
+
+    def __str__(self):
+        return "XRateRollup(%s=>%s, %s at %s): %s" % (self.from_currency, self.to_currency, self.bucket,
+                                                      self.start, self.close)
+
+
+# Functions that return the beginning of the bucket the time belongs to, by the bucket sizes
+ROLLUP_BUCKETS = {
+    "1h": lambda time: time.replace(minute=0, second=0, microsecond=0),
+    "1d": lambda time: time.replace(hour=0, minute=0, second=0, microsecond=0),
+    "1w": lambda time: (time - peewee_datetime.timedelta(days=time.weekday())).replace(hour=0, minute=0, second=0,
+                                                                                       microsecond=0),
+}
+
+
 class LatestUpdate(_LogModel):
     """The class that represents the latest update entity in the DB
 
@@ -152,15 +519,46 @@ class LatestUpdate(_LogModel):
         return str(self.datetime)
 
 
-class ApiLog(_LogModel):
+class ResponseBody(_PartitionedLogModel):
+    """The class that describes a model of compressed external APIs response texts.
+
+    The responses of external APIs are mostly identical from call to call, so every distinct response text
+    is stored only once per week, compressed, and API logs of the same week refer to it by its digest.
+
+    Attributes:
+        digest (CharField): SHA-256 digest of the response text, primary key.
+        body (BlobField): zlib-compressed response text.
+        created (DateTimeField): date and time when the response text was stored first.
+
+    """
+    class Meta:
+        db_table = "response_bodies"
+
+    digest = CharField(max_length=64, primary_key=True)
+    body = BlobField()
+    created = DateTimeField(default=peewee_datetime.datetime.now)
+
+    @staticmethod
+    def digest_of(text):
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def text(self):
+        return zlib.decompress(self.body).decode()
+
+
+class ApiLog(_PartitionedLogModel):
     """The class that describes a model of special logs of calls to external APIs.
 
+    Response texts are stored separately (see ResponseBody) and loaded only for displayed logs,
+    the response_text field is kept for the logs written before that.
+
     Attributes:
         request_url (CharField): URL for external API request.
         request_data (TextField): request data
         request_method (CharField): request method
         request_headers (TextField): request headers
         response_text (TextField): response text
+        response_digest (CharField): the digest of the stored response text.
         created (DateTimeField): date and time when the request was sent, index.
         finished (DateTimeField): date and time when the request was finished.
         error (TextField): error text.
@@ -174,12 +572,61 @@ class ApiLog(_LogModel):
     request_method = CharField(max_length=100)
     request_headers = TextField(null=True)
     response_text = TextField(null=True)
+    response_digest = CharField(max_length=64, null=True)
     created = DateTimeField(index=True, default=peewee_datetime.datetime.now)
     finished = DateTimeField()
     error = TextField(null=True)
 
+    @classmethod
+    def insert_logs(cls, rows):
+        """This method writes many API log entities at once, storing every distinct response text once, compressed.
+
+        Args:
+            rows (list): dicts with the values of the entities fields.
 
-class ErrorLog(_LogModel):
+        """
+        bodies = {}
+        for row in rows:
+            row.setdefault("created", peewee_datetime.datetime.now())
+            text = row.pop("response_text", None)
+            row["response_digest"] = None if text is None else ResponseBody.digest_of(text)
+            if text is not None:
+                bodies.setdefault(ResponseBody.partition(row["created"]), {}).setdefault(row["response_digest"], text)
+
+        # Response texts are stored in the same week partitions as the logs that refer to them
+        for model, texts in bodies.items():
+            for batch in chunked(texts.items(), 50):
+                (model.insert_many([{"digest": digest, "body": zlib.compress(text.encode())} for digest, text in batch])
+                 .on_conflict_ignore()
+                 .execute())
+
+        super().insert_logs(rows)
+
+    @classmethod
+    def load_logs(cls, logs):
+        """This method loads and decompresses response texts of the given API logs with one query.
+
+        Args:
+            logs (list): the log entities.
+
+        """
+        digests = {}
+        for log in logs:
+            if log.response_digest:
+                digests.setdefault(log.partition_key, set()).add(log.response_digest)
+
+        texts = {}
+        for key, partition_digests in digests.items():
+            model = ResponseBody._partition(key) if key else ResponseBody
+            texts.update({(key, body.digest): body.text()
+                          for body in model.select().where(model.digest.in_(partition_digests))})
+
+        for log in logs:
+            if log.response_digest:
+                log.response_text = texts.get((log.partition_key, log.response_digest))
+
+
+class ErrorLog(_PartitionedLogModel):
     """The class that describes a model of special logs of errors occurred during calls to external APIs.
 
     Attributes:
@@ -202,6 +649,182 @@ class ErrorLog(_LogModel):
     created = DateTimeField(default=peewee_datetime.datetime.now, index=True)
 
 
+def drop_expired_logs(retention_weeks=config.LOGS_RETENTION_WEEKS):
+    """This function drops all the log partitions older than the retention period.
+
+    Args:
+        retention_weeks (int): (optional) the number of weeks to keep the logs.
+
+    Returns:
+        list: The names of dropped tables.
+
+    """
+    before = peewee_datetime.datetime.now() - peewee_datetime.timedelta(weeks=retention_weeks)
+    return [table for model in (ApiLog, ResponseBody, ErrorLog) for table in model.drop_partitions(before)]
+
+
+def save_rates(xrates):
+    """This function stores new values of many exchange rates at once and updates the time of the latest update.
+
+    All the rates are written in one transaction with a bulk upsert (split into chunks only to respect
+    the SQLite limit of query variables), instead of saving every entity separately, and appended to the
+    rates history in the same transaction. The latest update entity is updated once for the whole batch.
+
+    Args:
+        xrates (list): XRate entities with new rates and update times.
+
+    """
+    if not xrates:
+        return
+
+    rows = [{"from_currency": xrate.from_currency, "to_currency": xrate.to_currency, "rate": xrate.rate,
+             "updated": xrate.updated, "module": xrate.module} for xrate in xrates]
+
+    with write_transaction(db):
+        for batch in chunked(rows, 100):
+            (XRate.insert_many(batch)
+             .on_conflict(conflict_target=[XRate.from_currency, XRate.to_currency],
+                          preserve=[XRate.rate, XRate.updated])
+             .execute())
+
+        for batch in chunked(rows, 100):
+            XRateHistory.insert_many([{"from_currency": row["from_currency"], "to_currency": row["to_currency"],
+                                       "rate": row["rate"], "created": row["updated"], "module": row["module"]}
+                                      for row in batch]).execute()
+
+        _update_rollups(rows)
+
+    with write_transaction(db_logs):
+        LatestUpdate.update(datetime=max(xrate.updated for xrate in xrates)).where(LatestUpdate.id == 1).execute()
+    bump_rates_version()
+
+
+# The id of the DB lock that serializes the snapshot publications
+_SNAPSHOT_LOCK_ID = 1000643
+
+
+def rates_snapshot():
+    """This function returns the current snapshot of all the rates, shared by all the app's processes.
+
+    The snapshot is read from the DB only if it hasn't been published yet.
+
+    Returns:
+        RatesSnapshot: The snapshot of the rates.
+
+    """
+    rates = snapshot.current()
+    if rates is None:
+        bump_rates_version()
+        rates = snapshot.current()
+    return rates
+
+
+def rates_version():
+    """This function returns the current version of the rates set, shared by all the app's processes.
+
+    Returns:
+        str: The version, it changes every time any rate is written.
+
+    """
+    return str(rates_snapshot().version)
+
+
+def bump_rates_version():
+    """This function publishes a new snapshot of the rates with a new version, it has to be called after every
+    rates write.
+
+    The snapshot is written to a temporary file which then replaces the published one atomically,
+    so the readers never see a partially written snapshot. The rates are read and published inside a write
+    transaction, so the publications of all the processes are serialized with the rates writes and with each other:
+    every publication contains all the rates committed before it and gets a greater version than the published one,
+    and a slow publication can never replace a newer snapshot with older rates.
+
+    """
+    with write_transaction(db):
+        if not isinstance(db, SqliteDatabase):
+            # Unlike SQLite, other DBs run write transactions concurrently, so publications take a lock explicitly
+            db.execute_sql("SELECT pg_advisory_xact_lock(%s)", (_SNAPSHOT_LOCK_ID,))
+        xrates = list(XRate.select().order_by(XRate.id))
+        latest_update = LatestUpdate.get(id=1).datetime
+        published = snapshot.current()
+        snapshot.publish(xrates, latest_update, max(time.time_ns(), published.version + 1 if published else 0))
+
+
+def _update_rollups(rows):
+    """Merge new rates into the rollups of all bucket sizes with one upsert per chunk.
+
+    A new bucket is created with all the OHLC values equal to the rate, and an existing one gets its
+    high/low extended, the close replaced and the rate added to the average.
+
+    Args:
+        rows (list): dicts with from_currency, to_currency, rate and updated keys.
+
+    """
+    rollups = [{"from_currency": row["from_currency"], "to_currency": row["to_currency"], "bucket": bucket,
+                "start": bucket_start(row["updated"]), "open": row["rate"], "high": row["rate"], "low": row["rate"],
+                "close": row["rate"], "total": row["rate"], "samples": 1}
+               for row in rows for bucket, bucket_start in ROLLUP_BUCKETS.items()]
+
+    for batch in chunked(rollups, 50):
+        (XRateRollup.insert_many(batch)
+         .on_conflict(conflict_target=[XRateRollup.from_currency, XRateRollup.to_currency,
+                                       XRateRollup.bucket, XRateRollup.start],
+                      update={XRateRollup.high: Case(None, [(EXCLUDED.high > XRateRollup.high, EXCLUDED.high)],
+                                                     XRateRollup.high),
+                              XRateRollup.low: Case(None, [(EXCLUDED.low < XRateRollup.low, EXCLUDED.low)],
+                                                    XRateRollup.low),
+                              XRateRollup.close: EXCLUDED.close,
+                              XRateRollup.total: XRateRollup.total + EXCLUDED.total,
+                              XRateRollup.samples: XRateRollup.samples + EXCLUDED.samples})
+         .execute())
+
+
+def backfill_rollups():
+    """This function recalculates all the rollups from the rates history.
+
+    The history is read once, ordered by rate and time, with a streaming iterator, and every bucket is
+    aggregated on the fly. Only the rollups of the current rate are kept in memory, they are written
+    with bulk inserts as soon as the rate is over, all in one transaction.
+
+    """
+    rollups = {}
+    history = (XRateHistory.select(XRateHistory.from_currency, XRateHistory.to_currency,
+                                   XRateHistory.rate, XRateHistory.created)
+               .order_by(XRateHistory.from_currency, XRateHistory.to_currency, XRateHistory.created)
+               .tuples())
+
+    def flush():
+        for batch in chunked(rollups.values(), 50):
+            XRateRollup.insert_many(batch).execute()
+        rollups.clear()
+
+    with write_transaction(db):
+        XRateRollup.delete().execute()
+        pair = None
+        for from_currency, to_currency, rate, created in history.iterator():
+            # Buckets of the previous pair are complete since the history is ordered by pairs
+            if pair != (from_currency, to_currency):
+                flush()
+                pair = (from_currency, to_currency)
+
+            for bucket, bucket_start in ROLLUP_BUCKETS.items():
+                start = bucket_start(created)
+                rollup = rollups.get((bucket, start))
+                if rollup is None:
+                    rollups[(bucket, start)] = {"from_currency": from_currency, "to_currency": to_currency,
+                                                "bucket": bucket, "start": start, "open": rate, "high": rate,
+                                                "low": rate, "close": rate, "total": rate, "samples": 1}
+                else:
+                    rollup["high"] = max(rollup["high"], rate)
+                    rollup["low"] = min(rollup["low"], rate)
+                    rollup["close"] = rate
+                    rollup["total"] += rate
+                    rollup["samples"] += 1
+        flush()
+
+    bump_rates_version()
+
+
 def start_db():
     """This function creates DB tables if they not exist and fills them with pre-defined values."""
     if not XRate.table_exists():
@@ -213,11 +836,32 @@ def start_db():
         XRate.create(from_currency=1000, to_currency=643, rate=1, module="blockchaininfo_api")
 
         print("Main table created!")
+    elif "refresh_interval" not in [column.name for column in db.get_columns(XRate._meta.table_name)]:
+        migrator = SchemaMigrator.from_database(db)
+        migrate(migrator.add_column(XRate._meta.table_name, "refresh_interval", XRate.refresh_interval))
+        print("Main table migrated!")
+
+    if not XRateHistory.table_exists():
+        XRateHistory.create_table()
+        print("Rates history table created!")
+
+    if not XRateRollup.table_exists():
+        XRateRollup.create_table()
+        backfill_rollups()
+        print("Rates rollups table created!")
 
     if not ApiLog.table_exists():
         ApiLog.drop_table()
         ApiLog.create_table()
         print("API logs table created!")
+    elif "response_digest" not in [column.name for column in db_logs.get_columns(ApiLog._meta.table_name)]:
+        migrator = SchemaMigrator.from_database(db_logs)
+        migrate(migrator.add_column(ApiLog._meta.table_name, "response_digest", ApiLog.response_digest))
+        print("API logs table migrated!")
+
+    if not ResponseBody.table_exists():
+        ResponseBody.create_table()
+        print("Response bodies table created!")
 
     if not ErrorLog.table_exists():
         ErrorLog.drop_table()
@@ -234,7 +878,10 @@ def start_db():
 def init_db():
     """This method does first initialization of the DB. Should be called only once."""
     XRate.drop_table()
+    XRateHistory.drop_table()
+    XRateRollup.drop_table()
     LatestUpdate.drop_table()
     ApiLog.drop_table()
+    ResponseBody.drop_table()
     ErrorLog.drop_table()
     start_db()
@@ -1,4 +1,4 @@
 #!/bin/bash
 
 exec python3 tasks.py &
-exec gunicorn -w 4 --bind 0.0.0.0:$PORT app:app
+exec gunicorn -w 4 -k gevent --worker-connections 1000 --bind 0.0.0.0:$PORT app:app
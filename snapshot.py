@@ -0,0 +1,132 @@
+"""This module contains the snapshot of all exchange rates shared by all the app's processes.
+
+The snapshot is a compact binary file published by the process that writes the rates (usually the scheduler)
+and memory-mapped by all the web workers, so reading the rates doesn't need any DB access. The file has
+a fixed header followed by columns of the rates in native byte order:
+
+    header: magic, version, latest update time, number of rates, size of the modules names block, padding
+    rates: rate (double) * n, updated (double) * n, from_currency (uint32) * n, to_currency (uint32) * n,
+        module index (uint16) * n
+    modules names: null-separated ASCII strings
+
+Every column is exposed as a zero-copy memoryview over the mapping. A published snapshot is never changed:
+a new one is written to a temporary file which then atomically replaces the old one, and the readers
+remap the file when they notice the replacement.
+
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from config import RATES_SNAPSHOT_PATH
+
+_MAGIC = b"GEXR"
+_HEADER = struct.Struct("=4sQdII4x")
+_COLUMNS = (("rate", "d"), ("updated", "d"), ("from_currency", "I"), ("to_currency", "I"), ("module", "H"))
+
+SnapshotRate = namedtuple("SnapshotRate", ["from_currency", "to_currency", "rate", "updated", "module"])
+
+
+class RatesSnapshot:
+    """The class that represents a published snapshot of all the rates, mapped into memory.
+
+    Rates can be iterated as SnapshotRate tuples, in the order they were published.
+
+    Attributes:
+        version (int): the version of the rates set, it changes with every published snapshot.
+        latest_update (datetime): date and time of the latest update of any rate.
+        columns (dict): column name => memoryview of the column values.
+        modules (list): names of the API handlers modules, module column values are indexes in this list.
+
+    """
+
+    def __init__(self, path=RATES_SNAPSHOT_PATH):
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Identity of the mapped file, it changes when the file is replaced
+        self.path, self.key = path, (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        magic, self.version, latest_update, count, modules_size = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a rates snapshot: {path}")
+        self.latest_update = datetime.fromtimestamp(latest_update)
+
+        view, offset = memoryview(self._mmap), _HEADER.size
+        self.columns = {}
+        for name, fmt in _COLUMNS:
+            size = struct.calcsize(fmt) * count
+            self.columns[name] = view[offset:offset + size].cast(fmt)
+            offset += size
+        self.modules = bytes(view[offset:offset + modules_size]).decode("ascii").split("\0")
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        columns = self.columns
+        return SnapshotRate(columns["from_currency"][index], columns["to_currency"][index], columns["rate"][index],
+                            datetime.fromtimestamp(columns["updated"][index]), self.modules[columns["module"][index]])
+
+    def __iter__(self):
+        return (self[index] for index in range(self._count))
+
+
+def publish(xrates, latest_update, version, path=RATES_SNAPSHOT_PATH):
+    """This function writes a new snapshot of the rates and atomically replaces the published one.
+
+    Args:
+        xrates (list): XRate entities.
+        latest_update (datetime): date and time of the latest update of any rate.
+        version (int): the version of the new rates set.
+        path (str): (optional) the path of the snapshot file.
+
+    """
+    modules = sorted({xrate.module for xrate in xrates})
+    module_indexes = {module: index for index, module in enumerate(modules)}
+    values = {"rate": [xrate.rate for xrate in xrates],
+              "updated": [xrate.updated.timestamp() for xrate in xrates],
+              "from_currency": [xrate.from_currency for xrate in xrates],
+              "to_currency": [xrate.to_currency for xrate in xrates],
+              "module": [module_indexes[xrate.module] for xrate in xrates]}
+    modules_names = "\0".join(modules).encode("ascii")
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as snapshot_file:
+        snapshot_file.write(_HEADER.pack(_MAGIC, version, latest_update.timestamp(), len(xrates),
+                                         len(modules_names)))
+        for name, fmt in _COLUMNS:
+            snapshot_file.write(struct.pack(f"={len(xrates)}{fmt}", *values[name]))
+        snapshot_file.write(modules_names)
+    os.replace(tmp_path, path)
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def current(path=RATES_SNAPSHOT_PATH):
+    """Return the latest published snapshot, the file is remapped only when it has been replaced.
+
+    Args:
+        path (str): (optional) the path of the snapshot file.
+
+    Returns:
+        RatesSnapshot: The snapshot, or None if it hasn't been published yet.
+
+    """
+    global _current
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    with _lock:
+        if _current is None or (_current.path, _current.key) != (path, (stat.st_ino, stat.st_mtime_ns, stat.st_size)):
+            _current = RatesSnapshot(path)
+        return _current
@@ -3,10 +3,12 @@
 import api
 import config
 import os
+import signal
+import sys
 import logging
 from logging.config import dictConfig
 from apscheduler.schedulers.blocking import BlockingScheduler
-from models import XRate, ApiLog, ErrorLog
+from models import drop_expired_logs, db_connection
 
 
 # Initialize a scheduler
@@ -15,22 +17,22 @@ dictConfig(config.LOGGING)
 log = logging.getLogger("Tasks")
 
 
-@sched.scheduled_job('interval', hours=1)
+@sched.scheduled_job('interval', seconds=config.REFRESH_TICK_INTERVAL)
 def update_rates():
-    """The function for periodic updating all rates in the application."""
-    log.info("Job started")
-    xrates = XRate.select()
-    for rate in xrates:
-        try:
-            api.update_rate(rate.from_currency, rate.to_currency)
-        except Exception as ex:
-            log.exception(ex)
-    log.info("Job finished")
+    """The function for periodic updating of the rates which are due according to their adaptive schedules."""
+    with db_connection():
+        outcomes = api.update_due_rates()
+    # The job runs often, so only the actual updates are logged
+    for (from_currency, to_currency), ex in outcomes.items():
+        if ex is None:
+            log.info(f"Updated {from_currency}=>{to_currency}, next in {api.schedule.interval(from_currency, to_currency)} s")
+        else:
+            log.error(f"Failed to update {from_currency}=>{to_currency}", exc_info=ex)
 
 
 @sched.scheduled_job('interval', days=7)
 def cleanup():
-    """The function for periodic erasing all logs."""
+    """The function for periodic erasing of the app's logs and old logs of external API calls."""
     # Erase internal app's logs
     log.info("Cleanup started")
     try:
@@ -42,12 +44,12 @@ def cleanup():
     except Exception as ex:
         log.exception(ex)
 
-    # Erase logs of calls to external APIs and occurred errors
+    # Drop logs of calls to external APIs and occurred errors of the weeks beyond the retention period
     try:
-        for table_log in ApiLog, ErrorLog:
-            table_log.drop_table()
-            table_log.create_table()
-            log.info(f"{table_log.__name__} cleaned")
+        with db_connection():
+            tables = drop_expired_logs()
+        for table in tables:
+            log.info(f"{table} dropped")
     except Exception as ex:
         log.exception(ex)
 
@@ -56,6 +58,11 @@ def cleanup():
 
 def start():
     """Scheduler entrypoint"""
+    # Create all the API handlers once, they will be reused by every rates update
+    with db_connection():
+        api.registry.load()
+    # Exit normally on termination, so the queued logs are written by the exit handlers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     sched.start()
     log.info("Scheduler started")
 
@@ -1,16 +1,32 @@
 """This module contains all tests."""
 
+import asyncio
+import csv
 import http
+import io
+import time
 import unittest
 import json
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
+import aiohttp
+import peewee
 import xmltodict
+from flask import jsonify
 import requests
 
 import models
 import api
+import config
+import converter
+import events
+from api.sessions import SessionManager, AsyncSessionManager, Response
+from api.log_sink import LogSink
+from api.schedule import RefreshSchedule
+from api.resilience import CircuitBreaker, CircuitOpenError
+from api import privat_api, cbr_api
 from app import app
 
 
@@ -38,6 +54,12 @@ class Test(unittest.TestCase):
     # def setUp(self):
     #    models.init_db()
 
+    def setUp(self):
+        # Outdated rates would be refreshed in the background from the real external APIs
+        patcher = patch('api.revalidate')
+        self.revalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
     @unittest.skip("skip")
     def test_privat_usd(self):
         """ Procedure:
@@ -58,11 +80,12 @@ class Test(unittest.TestCase):
         updated_before = xrate.updated
 
         api.update_rate(840, 980)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=840, to_currency=980)
         updated_after = xrate.updated
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertGreater(xrate.rate, 25)
         self.assertGreater(updated_after, updated_before)
@@ -79,6 +102,7 @@ class Test(unittest.TestCase):
         updated_before = xrate.updated
 
         api.update_rate(1000, 840)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=1000, to_currency=840)
         updated_after = xrate.updated
@@ -86,7 +110,7 @@ class Test(unittest.TestCase):
         self.assertGreater(xrate.rate, 4000)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "https://api.privatbank.ua/p24api/pubinfo?exchange&json&coursid=11")
@@ -97,6 +121,7 @@ class Test(unittest.TestCase):
         updated_before = xrate.updated
 
         api.update_rate(840, 643)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=840, to_currency=643)
         updated_after = xrate.updated
@@ -104,7 +129,7 @@ class Test(unittest.TestCase):
         self.assertGreater(xrate.rate, 60)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "http://www.cbr.ru/scripts/XML_daily.asp")
@@ -118,6 +143,7 @@ class Test(unittest.TestCase):
         updated_before = xrate.updated
 
         api.update_rate(840, 980)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(id=1)
         updated_after = xrate.updated
@@ -125,7 +151,7 @@ class Test(unittest.TestCase):
         self.assertEqual(xrate.rate, 30)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "https://api.privatbank.ua/p24api/pubinfo?exchange&json&coursid=11")
@@ -140,6 +166,7 @@ class Test(unittest.TestCase):
         updated_before = xrate.updated
 
         self.assertRaises(requests.exceptions.RequestException, api.update_rate, 840, 980)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(id=1)
         updated_after = xrate.updated
@@ -147,14 +174,14 @@ class Test(unittest.TestCase):
         self.assertEqual(xrate.rate, 1.0)
         self.assertEqual(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "https://api.privatbank.ua/p24api/pubinfo?exchange&json&coursid=11")
         self.assertIsNone(api_log.response_text)
         self.assertIsNotNone(api_log.error)
 
-        error_log = models.ErrorLog.select().order_by(models.ErrorLog.created.desc()).first()
+        error_log = models.ErrorLog.select_page(size=1)[0][0]
         self.assertIsNotNone(error_log)
         self.assertEqual(error_log.request_url, "https://api.privatbank.ua/p24api/pubinfo?exchange&json&coursid=11")
         self.assertIsNotNone(error_log.traceback)
@@ -172,6 +199,7 @@ class Test(unittest.TestCase):
         self.assertEqual(xrate.rate, 1.0)
 
         api.update_rate(from_currency, to_currency)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=from_currency, to_currency=to_currency)
         updated_after = xrate.updated
@@ -179,7 +207,7 @@ class Test(unittest.TestCase):
         self.assertGreater(xrate.rate, 100000)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "https://api.cryptonator.com/api/ticker/btc-uah")
@@ -196,6 +224,7 @@ class Test(unittest.TestCase):
         self.assertEqual(xrate.rate, 1.0)
 
         api.update_rate(from_currency, to_currency)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=from_currency, to_currency=to_currency)
         updated_after = xrate.updated
@@ -203,7 +232,7 @@ class Test(unittest.TestCase):
         self.assertGreater(xrate.rate, 100000)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertEqual(api_log.request_url, "https://blockchain.info/ticker")
@@ -220,6 +249,7 @@ class Test(unittest.TestCase):
         self.assertEqual(xrate.rate, 1.0)
 
         api.update_rate(from_currency, to_currency)
+        api.log_sink.flush()
 
         xrate = models.XRate.get(from_currency=from_currency, to_currency=to_currency)
         updated_after = xrate.updated
@@ -227,7 +257,7 @@ class Test(unittest.TestCase):
         self.assertGreater(xrate.rate, 100000)
         self.assertGreater(updated_after, updated_before)
 
-        api_log = models.ApiLog.select().order_by(models.ApiLog.created.desc()).first()
+        api_log = models.ApiLog.select_page(size=1)[0][0]
 
         self.assertIsNotNone(api_log)
         self.assertIn('https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest?CMC_PRO_API_KEY=',
@@ -263,6 +293,12 @@ class Test(unittest.TestCase):
         self.assertIsInstance(json_rates, list)
         self.assertEqual(len(json_rates), 2)
 
+        # Currency codes are compared as numbers
+        r = client.get("http://localhost:5000/api/xrates/json?from_currency=0840&to_currency=980")
+        self.assertEqual([(rate["from"], rate["to"]) for rate in r.json], [(840, 980)])
+        r = client.get("http://localhost:5000/api/xrates/json?to_currency=UAH")
+        self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+
     @unittest.skip("skip")
     def test_html_xrates(self):
         client = app.test_client()
@@ -307,10 +343,782 @@ class Test(unittest.TestCase):
         self.assertEqual(r.status_code, http.HTTPStatus.FOUND)
         # print(models.XRate.get(from_currency=from_currency, to_currency=to_currency).rate)
         self.assertEqual(models.XRate.get(from_currency=from_currency, to_currency=to_currency).rate, 999.0)
+        # The edit is stored like a fetched rate
+        self.assertEqual([(rate.from_currency, rate.to_currency) for rate in models.rates_snapshot() if rate.rate == 999.0],
+                         [(from_currency, to_currency)])
+        history = models.XRateHistory.select().where(models.XRateHistory.rate == 999.0)
+        self.assertEqual([(rate.from_currency, rate.to_currency) for rate in history], [(from_currency, to_currency)])
+        models.XRateHistory.delete().where(models.XRateHistory.rate == 999.0).execute()
         xrate.rate = old_rate
         xrate.save()
+        models.bump_rates_version()
         self.assertEqual(models.XRate.get(from_currency=from_currency, to_currency=to_currency).rate, 1.0)
 
+    def test_update_rates_concurrently(self):
+        def fetch_rate(xrate):
+            time.sleep(0.2)
+            if xrate.module == "cbr_api":
+                raise ValueError("CBR is down")
+            return 2.0
+
+        started = time.monotonic()
+        with patch('api._fetch_rate', new=fetch_rate), patch('api.save_rates') as save_rates:
+            outcomes = api.update_rates()
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(len(outcomes), 5)
+        self.assertIsInstance(outcomes[(840, 643)], ValueError)
+        self.assertIsNone(outcomes[(840, 980)])
+        # Two privat_api pairs share one module, but the per-module limit still lets them run together
+        self.assertLess(elapsed, 0.2 * 5)
+
+        # All fetched rates are stored at once
+        save_rates.assert_called_once()
+        saved = save_rates.call_args.args[0]
+        self.assertEqual(len(saved), 4)
+        self.assertTrue(all(xrate.rate == 2.0 for xrate in saved))
+
+    def test_update_rates_shares_responses(self):
+        calls = []
+
+        def send(*args, **kwds):
+            calls.append(kwds["url"])
+            response = get_privat_response()
+            response.text = json.dumps([{"ccy": "USD", "base_ccy": "UAH", "sale": "30.0"},
+                                        {"ccy": "BTC", "base_ccy": "USD", "sale": "20000.0"}])
+            return response
+
+        privat_rates = list(models.XRate.select().where(models.XRate.module == "privat_api"))
+        saved = [(xrate.id, xrate.rate, xrate.updated) for xrate in privat_rates]
+        try:
+            with patch('api._Api._send', new=send):
+                outcomes = api.update_rates(privat_rates)
+            self.assertEqual(outcomes, {(840, 980): None, (1000, 840): None})
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(models.XRate.get(from_currency=840, to_currency=980).rate, 30.0)
+            self.assertEqual(models.XRate.get(from_currency=1000, to_currency=840).rate, 20000.0)
+        finally:
+            for xrate_id, rate, updated in saved:
+                models.XRate.update(rate=rate, updated=updated).where(models.XRate.id == xrate_id).execute()
+
+    def test_http_session_pool(self):
+        manager = SessionManager(pool_connections=3, pool_maxsize=7, retries=4, backoff_factor=0.1)
+        session = manager.session()
+        self.assertIs(manager.session(), session)
+
+        adapter = session.get_adapter("https://api.privatbank.ua/")
+        self.assertEqual(adapter._pool_maxsize, 7)
+        self.assertEqual(adapter.max_retries.total, 4)
+        self.assertEqual(adapter.max_retries.backoff_factor, 0.1)
+
+        manager.close()
+        self.assertIsNot(manager.session(), session)
+
+    def test_handlers_registry(self):
+        api.registry.load()
+        with patch.object(models.XRate, 'select', side_effect=AssertionError("No DB queries expected")):
+            usd_handler, usd_xrate = api.registry.resolve(840, 980)
+            btc_handler, btc_xrate = api.registry.resolve(1000, 840)
+
+        self.assertIs(usd_handler, btc_handler)
+        self.assertEqual(usd_handler.__module__, "api.privat_api")
+        self.assertEqual((btc_xrate.from_currency, btc_xrate.to_currency), (1000, 840))
+        self.assertRaises(ValueError, api.registry.resolve, 840, 1000)
+        # The test handler simulates rates, so it is never used for real ones
+        self.assertRaises(ValueError, api.registry.handler, "test_api")
+
+    def test_json_history(self):
+        client = app.test_client()
+        start = models.peewee_datetime.datetime(2020, 1, 1)
+        models.XRateHistory.insert_many([
+            {"from_currency": 1, "to_currency": 2, "rate": float(hour), "module": "test_api",
+             "created": start + models.peewee_datetime.timedelta(hours=hour)} for hour in range(5)]).execute()
+        try:
+            url = "http://localhost:5000/api/xrates/history"
+            args = {"from_currency": 1, "to_currency": 2, "limit": 2,
+                    "start": "2020-01-01T01:00:00", "end": "2020-01-01T05:00:00"}
+            pages = []
+            r = client.get(url, query_string=args).json
+            pages.append(r["history"])
+            while r["next_cursor"]:
+                r = client.get(url, query_string={**args, "cursor": r["next_cursor"]}).json
+                pages.append(r["history"])
+
+            self.assertEqual([[rate["rate"] for rate in page] for page in pages], [[1.0, 2.0], [3.0, 4.0], []])
+            self.assertEqual(pages[0][0]["created"], "2020-01-01T01:00:00")
+
+            # Invalid arguments are rejected as bad requests
+            for invalid in ({"limit": "ten"}, {"limit": 0}, {"cursor": "2020-01-01T01:00:00,one"}, {"cursor": "x"},
+                            {"start": "yesterday"}, {"from_currency": "USD"}):
+                r = client.get(url, query_string={**args, **invalid})
+                self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+        finally:
+            models.XRateHistory.delete().where(models.XRateHistory.from_currency == 1).execute()
+
+    def test_rollups(self):
+        client = app.test_client()
+        day = models.peewee_datetime.datetime(2020, 1, 1)
+        models.XRateHistory.insert_many([
+            {"from_currency": 980, "to_currency": 840, "rate": rate, "module": "test_api",
+             "created": day + models.peewee_datetime.timedelta(minutes=minutes)}
+            for minutes, rate in ((30, 1.0), (90, 3.0), (130, 2.0))]).execute()
+        try:
+            models.backfill_rollups()
+            # New rates are merged into the existing rollups
+            models._update_rollups([{"from_currency": 980, "to_currency": 840, "rate": 5.0,
+                                     "updated": day + models.peewee_datetime.timedelta(hours=3)}])
+
+            r = client.get("http://localhost:5000/api/xrates/json?rollup=1d&from_currency=980")
+            self.assertEqual(r.json, [{"alias": "UAH-USD", "from": 980, "to": 840, "bucket": "1d",
+                                       "start": "2020-01-01T00:00:00", "open": 1.0, "high": 5.0, "low": 1.0,
+                                       "close": 5.0, "average": 2.75, "samples": 4}])
+
+            r = client.get("http://localhost:5000/api/xrates/xml?rollup=1h&from_currency=980")
+            xml_rollups = xmltodict.parse(r.text)["rollups"]["rollup"]
+            self.assertEqual([rollup["close"] for rollup in xml_rollups], ["1.0", "3.0", "2.0", "5.0"])
+
+            for invalid in ("rollup=1y", "rollup=1d&limit=all", "rollup=1d&limit=0", "rollup=1d&start=yesterday",
+                            "rollup=1d&end=2020-13-01"):
+                r = client.get(f"http://localhost:5000/api/xrates/json?{invalid}")
+                self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+        finally:
+            models.XRateHistory.delete().where(models.XRateHistory.from_currency == 980).execute()
+            models.XRateRollup.delete().where(models.XRateRollup.from_currency == 980).execute()
+
+    def test_api_response_cache(self):
+        client = app.test_client()
+        url = "http://localhost:5000/api/xrates/json?to_currency=980"
+        r = client.get(url)
+
+        # The same request is served from the cache without any DB queries
+        with patch('controllers.XRate.select', side_effect=AssertionError("No DB queries expected")):
+            cached = client.get(url)
+        self.assertEqual(cached.data, r.data)
+        self.assertEqual(cached.content_type, r.content_type)
+
+        # Any rates write makes the cache outdated
+        models.bump_rates_version()
+        with patch('controllers.jsonify', wraps=jsonify) as render:
+            self.assertEqual(client.get(url).json, r.json)
+        render.assert_called()
+
+    def test_conditional_responses(self):
+        client = app.test_client()
+        for url in ("http://localhost:5000/api/xrates/json", "http://localhost:5000/api/xrates/xml",
+                    "http://localhost:5000/xrates"):
+            r = client.get(url)
+            self.assertEqual(r.status_code, http.HTTPStatus.OK)
+            etag, weak = r.get_etag()
+            self.assertIsNotNone(etag)
+            self.assertIsNotNone(r.last_modified)
+            self.assertIsNotNone(r.cache_control.max_age)
+            # HTML pages show the minutes past the latest update, so their tags are weak
+            self.assertEqual(weak, url.endswith("xrates"))
+
+            time.sleep(0.01)
+            with patch('controllers.XRate.select', side_effect=AssertionError("No DB queries expected")):
+                r = client.get(url, headers={"If-None-Match": r.headers["ETag"]})
+            self.assertEqual(r.status_code, http.HTTPStatus.NOT_MODIFIED)
+            self.assertEqual(r.data, b"")
+
+        r = client.get("http://localhost:5000/api/xrates/json")
+        r = client.get("http://localhost:5000/api/xrates/json", headers={"If-Modified-Since": r.headers["Last-Modified"]})
+        self.assertEqual(r.status_code, http.HTTPStatus.NOT_MODIFIED)
+        r = client.get("http://localhost:5000/api/xrates/json", headers={"If-None-Match": '"outdated"'})
+        self.assertEqual(r.status_code, http.HTTPStatus.OK)
+
+    def test_currency_graph(self):
+        xrates = [models.XRate(from_currency=840, to_currency=980, rate=40.0),
+                  models.XRate(from_currency=840, to_currency=643, rate=80.0),
+                  models.XRate(from_currency=1000, to_currency=840, rate=20000.0)]
+        graph = converter.CurrencyGraph(xrates)
+
+        result, rate, path = graph.convert(980, 643, 100)
+        self.assertAlmostEqual(rate, 2.0)
+        self.assertAlmostEqual(result, 200.0)
+        self.assertEqual([(edge[0], edge[1], edge[3]) for edge in path], [(980, 840, True), (840, 643, False)])
+
+        self.assertAlmostEqual(graph.convert(1000, 980)[1], 800000.0)
+        self.assertEqual(graph.convert(840, 840), (1.0, 1.0, []))
+        self.assertRaises(ValueError, graph.convert, 840, 978)
+
+        # Rates which are not positive are skipped instead of breaking all the conversions
+        graph = converter.CurrencyGraph(xrates + [models.XRate(from_currency=840, to_currency=978, rate=0.0),
+                                                  models.XRate(from_currency=978, to_currency=392, rate=-1.0)])
+        self.assertAlmostEqual(graph.convert(980, 643)[1], 2.0)
+        self.assertRaises(ValueError, graph.convert, 840, 978)
+        self.assertRaises(ValueError, graph.convert, 978, 392)
+
+    def test_json_convert(self):
+        client = app.test_client()
+        r = client.get("http://localhost:5000/api/convert?from=980&to=643&amount=10")
+        self.assertEqual(r.status_code, http.HTTPStatus.OK)
+        self.assertEqual([(edge["from"], edge["to"]) for edge in r.json["path"]], [(980, 840), (840, 643)])
+        self.assertEqual(r.json["result"], r.json["rate"] * 10)
+
+        # Invalid arguments are rejected, currencies without a chain of rates are not found
+        for query in ("to=643", "from=980", "from=UAH&to=643", "from=980&to=643&amount=ten"):
+            r = client.get(f"http://localhost:5000/api/convert?{query}")
+            self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+        r = client.get("http://localhost:5000/api/convert?from=980&to=392")
+        self.assertEqual(r.status_code, http.HTTPStatus.NOT_FOUND)
+
+    def test_log_sink(self):
+        sink = LogSink(batch_size=2, flush_interval=60)
+        url = "https://example.com/test-log-sink"
+        api_log = models.ApiLog.partition()
+        try:
+            for i in range(3):
+                sink.write(models.ApiLog, request_url=url, request_method="get", response_text=str(i),
+                           finished=models.peewee_datetime.datetime.now())
+
+            # The full batch is written in the background, the rest waits for the flush interval
+            time.sleep(0.2)
+            self.assertEqual(api_log.select().where(api_log.request_url == url).count(), 2)
+
+            # Everything queued is written on stop
+            sink.stop()
+            logs = list(api_log.select().where(api_log.request_url == url).order_by(api_log.id))
+            models.ApiLog.load_logs(logs)
+            self.assertEqual([log.response_text for log in logs], ["0", "1", "2"])
+        finally:
+            sink.stop()
+            api_log.delete().where(api_log.request_url == url).execute()
+
+    def test_api_logs_bodies(self):
+        client = app.test_client()
+        url = "https://example.com/test-api-logs-bodies"
+        text = json.dumps([{"ccy": "USD", "base_ccy": "UAH", "sale": "30.0"}] * 100)
+        api_log, response_body = models.ApiLog.partition(), models.ResponseBody.partition()
+        try:
+            now = models.peewee_datetime.datetime.now()
+            models.ApiLog.insert_logs([{"request_url": url, "request_method": "get", "response_text": text,
+                                        "finished": now} for _ in range(3)])
+
+            logs = list(api_log.select().where(api_log.request_url == url))
+            self.assertEqual(len(logs), 3)
+            self.assertEqual({log.response_digest for log in logs}, {models.ResponseBody.digest_of(text)})
+            self.assertTrue(all(log.response_text is None for log in logs))
+            body = response_body.get(digest=logs[0].response_digest)
+            self.assertLess(len(body.body), len(text) / 10)
+
+            r = client.get("http://localhost:5000/logs/api/json")
+            self.assertEqual([log["response_text"] for log in r.json if log["request_url"] == url], [text] * 3)
+        finally:
+            api_log.delete().where(api_log.request_url == url).execute()
+            response_body.delete().where(response_body.digest == models.ResponseBody.digest_of(text)).execute()
+
+    def test_logs_partitions(self):
+        week = models.peewee_datetime.timedelta(weeks=1)
+        now = models.peewee_datetime.datetime.now()
+        url = "https://example.com/test-logs-partitions"
+        # Retention drops and recreates the base table, so the partitions are tested in a temporary DB
+        logs_db = peewee.SqliteDatabase(":memory:")
+        with logs_db.bind_ctx([models.ErrorLog]), patch.dict(models.ErrorLog._partitions, clear=True):
+            models.ErrorLog.create_table()
+            models.ErrorLog.insert_logs([{"request_url": url, "request_method": "get", "error": str(weeks),
+                                          "created": now - weeks * week} for weeks in (10, 0, 1)])
+            partitions = models.ErrorLog.partitions()
+            self.assertIs(partitions[-1], models.ErrorLog)
+            self.assertEqual(partitions[:3], [models.ErrorLog.partition(now - weeks * week) for weeks in (0, 1, 10)])
+            self.assertTrue(all(model._meta.database is logs_db for model in partitions))
+
+            # Pages are read across partitions, the latest logs first
+            logs = models.ErrorLog.select_page(size=100)[0]
+            self.assertEqual([log.error for log in logs], ["0", "1", "10"])
+
+            dropped = models.ErrorLog.drop_partitions(now - 5 * week)
+            self.assertIn(models.ErrorLog.partition(now - 10 * week)._meta.table_name, dropped)
+            self.assertNotIn(models.ErrorLog.partition(now)._meta.table_name, dropped)
+            self.assertEqual([log.error for log in models.ErrorLog.select_page(size=100)[0]], ["0", "1"])
+        logs_db.close()
+        self.assertIs(models.ErrorLog._meta.database, models.db_logs)
+
+    def test_logs_cursor_pages(self):
+        client = app.test_client()
+        week = models.peewee_datetime.timedelta(weeks=1)
+        now = models.peewee_datetime.datetime.now()
+        url = "https://example.com/test-logs-cursor-pages"
+        logs_db = peewee.SqliteDatabase(":memory:")
+        with logs_db.bind_ctx([models.ErrorLog]), patch.dict(models.ErrorLog._partitions, clear=True):
+            models.ErrorLog.create_table()
+            models.ErrorLog.insert_logs([{"request_url": url, "request_method": "get", "error": str(weeks),
+                                          "created": now - weeks * week} for weeks in (0, 1, 10)])
+            # Following the cursors reads all the logs once, across partitions, the latest first
+            errors, cursor = [], None
+            while True:
+                args = {"cursor": cursor, "limit": 1} if cursor else {"limit": 1}
+                r = client.get("http://localhost:5000/logs/errors/json", query_string=args)
+                self.assertEqual(r.status_code, 200)
+                errors += [log["error"] for log in r.json if log["request_url"] == url]
+                cursor = r.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            self.assertEqual(errors, ["0", "1", "10"])
+
+            for args in ({"limit": 1000}, {"limit": "all"}, {"cursor": "2020_01"}, {"cursor": ":last"}):
+                r = client.get("http://localhost:5000/logs/errors/json", query_string=args)
+                self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+
+            r = client.get("http://localhost:5000/logs/errors/export/ndjson")
+            self.assertEqual(r.mimetype, "application/x-ndjson")
+            exported = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+            self.assertEqual([log["error"] for log in exported if log["request_url"] == url], ["0", "1", "10"])
+
+            r = client.get("http://localhost:5000/logs/errors/export/csv")
+            rows = list(csv.DictReader(io.StringIO(r.get_data(as_text=True))))
+            self.assertEqual(len(rows), len(exported))
+            self.assertEqual([row["error"] for row in rows if row["request_url"] == url], ["0", "1", "10"])
+        logs_db.close()
+
+    def test_db_connections_pool(self):
+        client = app.test_client()
+        r = client.get("http://localhost:5000/api/xrates/json")
+        self.assertEqual(r.status_code, 200)
+        # The request's connections are returned to the pools
+        self.assertTrue(models.db.is_closed())
+        self.assertTrue(models.db_logs.is_closed())
+
+        def count():
+            with models.db_connection():
+                return models.XRate.select().count()
+
+        with ThreadPoolExecutor(4) as executor:
+            counts = list(executor.map(lambda _: count(), range(8)))
+        self.assertEqual(len(set(counts)), 1)
+        # Connections are reused by the threads and none of them stays taken
+        self.assertFalse(models.db._in_use)
+        self.assertLessEqual(len(models.db._connections), 4)
+
+    def test_sqlite_write_transactions(self):
+        with models.db_connection():
+            self.assertEqual(models.db.execute_sql("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(models.db_logs.execute_sql("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        writers, overlaps = [], []
+
+        def write():
+            with models.db_connection(), models.write_transaction(models.db):
+                writers.append(1)
+                overlaps.append(len(writers))
+                models.XRate.select().count()
+                time.sleep(0.01)
+                writers.pop()
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(lambda _: write(), range(8)))
+        # Writers of the process never overlap
+        self.assertEqual(overlaps, [1] * 8)
+
+    def test_rates_snapshot(self):
+        client = app.test_client()
+        models.bump_rates_version()
+        xrates = models.rates_snapshot()
+        self.assertEqual([(xrate.from_currency, xrate.to_currency, xrate.rate, xrate.module) for xrate in xrates],
+                         [(xrate.from_currency, xrate.to_currency, xrate.rate, xrate.module)
+                          for xrate in models.XRate.select().order_by(models.XRate.id)])
+        self.assertEqual(xrates.latest_update, models.LatestUpdate.get(id=1).datetime)
+        # The published snapshot is mapped once until it is replaced
+        self.assertIs(models.rates_snapshot(), xrates)
+        models.bump_rates_version()
+        self.assertGreater(models.rates_snapshot().version, xrates.version)
+
+        # The snapshot is published while holding the write lock, so publications can't overtake each other
+        def publish(*args, **kwds):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                self.assertFalse(executor.submit(models._write_locks[models.db].acquire, blocking=False).result())
+
+        with patch('snapshot.publish', side_effect=publish) as published:
+            models.bump_rates_version()
+        published.assert_called_once()
+        # Versions never go back, even if the clock does
+        with patch('time.time_ns', return_value=0):
+            models.bump_rates_version()
+        self.assertGreater(models.rates_snapshot().version, xrates.version)
+
+        # Pages and API responses are rendered without any DB queries
+        with patch('models.XRate.select', side_effect=AssertionError("No DB queries expected")), \
+                patch('models.LatestUpdate.get', side_effect=AssertionError("No DB queries expected")):
+            for url in ("http://localhost:5000/xrates", "http://localhost:5000/api",
+                        "http://localhost:5000/api/xrates/json?from_currency=840"):
+                self.assertEqual(client.get(url).status_code, 200)
+            r = client.get("http://localhost:5000/api/xrates/json?from_currency=840&to_currency=980")
+        self.assertEqual([(rate["from"], rate["to"]) for rate in r.json], [(840, 980)])
+
+    def test_latest_update_without_db(self):
+        client = app.test_client()
+        latest_update = models.rates_snapshot().latest_update
+        models.close_db()
+        with patch.object(models.db, 'connect', side_effect=AssertionError("No DB connections expected")), \
+                patch.object(models.db_logs, 'connect', side_effect=AssertionError("No DB connections expected")):
+            for url in ("http://localhost:5000/", "http://localhost:5000/xrates", "http://localhost:5000/api"):
+                r = client.get(url)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(r.headers["X-Latest-Update"], latest_update.isoformat())
+
+    def test_rates_events(self):
+        client = app.test_client()
+        broker = events.RatesBroker()
+        subscription = broker.subscribe(840, 980)
+        stream = subscription.stream(heartbeat_interval=0.01)
+        first = next(stream)
+        self.assertTrue(first.startswith(f"id: {models.rates_snapshot().version}\nevent: rates\n"))
+        self.assertEqual([(rate["from"], rate["to"]) for rate in json.loads(first.split("data: ")[1])], [(840, 980)])
+        self.assertEqual(next(stream), ": heartbeat\n\n")
+
+        xrate = models.XRate.get(from_currency=840, to_currency=980)
+        try:
+            models.XRate.update(rate=xrate.rate + 1).where(models.XRate.id == xrate.id).execute()
+            models.bump_rates_version()
+            self.assertEqual(broker.check(), 1)
+            self.assertEqual(json.loads(next(stream).split("data: ")[1])[0]["rate"], xrate.rate + 1)
+            # Rates refreshed without changes are not sent
+            models.XRate.update(updated=models.peewee_datetime.datetime.now()).where(models.XRate.id == xrate.id).execute()
+            models.bump_rates_version()
+            self.assertEqual(broker.check(), 0)
+            self.assertTrue(subscription._queue.empty())
+            # Subscribers of other pairs don't get the changes
+            other = broker.subscribe(1000)
+            models.bump_rates_version()
+            self.assertEqual(broker.check(), 0)
+            self.assertTrue(other._queue.empty())
+        finally:
+            models.XRate.update(rate=xrate.rate, updated=xrate.updated).where(models.XRate.id == xrate.id).execute()
+            models.bump_rates_version()
+        stream.close()
+        self.assertNotIn(subscription, broker._subscribers)
+
+        r = client.get("http://localhost:5000/api/xrates/stream?from_currency=840")
+        self.assertEqual(r.mimetype, "text/event-stream")
+        self.assertIn(b"event: rates", next(iter(r.response)))
+        r.close()
+        r = client.get("http://localhost:5000/api/xrates/stream?to_currency=UAH")
+        self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+
+    def test_refresh_schedule(self):
+        schedule = RefreshSchedule(backoff=2, volatility=0.01)
+        hour = models.peewee_datetime.timedelta(hours=1)
+        _, cbr = api.registry.resolve(840, 643)
+        # Pairs are due one base interval of their handler after the latest update
+        self.assertNotIn(cbr, schedule.due(cbr.updated + 5 * hour))
+        self.assertIn(cbr, schedule.due(cbr.updated + 6 * hour))
+
+        # Unchanged rates are refreshed less and less often, up to the handler's maximum
+        now = models.peewee_datetime.datetime.now()
+        xrate = models.XRate(from_currency=840, to_currency=643, rate=60.0, module="cbr_api", updated=now)
+        for interval in (12, 24, 24):
+            schedule.record(xrate, 60.0, now=now)
+            self.assertEqual(schedule.interval(840, 643), interval * 3600)
+
+        # Rates are refreshed before they turn stale, even if they didn't change
+        xrate = models.XRate(from_currency=840, to_currency=980, rate=30.0, module="privat_api", updated=now)
+        for _ in range(3):
+            schedule.record(xrate, 30.0, now=now)
+        self.assertEqual(schedule.interval(840, 980), config.RATES_FRESH_TTL - config.REFRESH_TICK_INTERVAL)
+
+        # Volatile rates are refreshed more and more often, down to the handler's minimum, errors change nothing
+        xrate = models.XRate(from_currency=1000, to_currency=643, module="blockchaininfo_api", updated=now)
+        for rate, interval in ((100.0, 150), (110.0, 75), (100.0, 60), (100.0, 120)):
+            previous, xrate.rate = xrate.rate or 110.0, rate
+            schedule.record(xrate, previous, now=now)
+            schedule.record(xrate, previous, ex=ValueError("Down"), now=now)
+            self.assertEqual(schedule.interval(1000, 643), interval)
+
+        # The base interval of a rate can be set on its DB entity
+        xrate = models.XRate(from_currency=1000, to_currency=978, module="blockchaininfo_api", updated=now,
+                             refresh_interval=30, rate=1.0)
+        schedule.record(xrate, 2.0, now=now)
+        self.assertEqual(schedule.interval(1000, 978), 30)
+
+        # The pairs added after the routes were built are scheduled as well
+        models.XRate.create(from_currency=978, to_currency=980, rate=33.0, module="privat_api", updated=now)
+        try:
+            self.assertIn((978, 980), [(xrate.from_currency, xrate.to_currency)
+                                       for xrate in schedule.due(now + 24 * hour)])
+        finally:
+            models.XRate.delete().where(models.XRate.from_currency == 978, models.XRate.to_currency == 980).execute()
+            api.registry.reload_routes()
+
+    def test_circuit_breaker(self):
+        handler = privat_api.Api()
+        handler.breaker = CircuitBreaker("PrivatApi", failure_threshold=2, reset_timeout=0.05)
+        url = "https://example.com/test-circuit-breaker"
+        with patch.object(handler, '_send', side_effect=requests.exceptions.ConnectionError("Down")) as send:
+            for _ in range(2):
+                self.assertRaises(requests.exceptions.ConnectionError, handler._send_request, url, "get")
+            # The open breaker fails at once without calling the external API
+            self.assertRaises(CircuitOpenError, handler._send_request, url, "get")
+            self.assertEqual(send.call_count, 2)
+
+            # A failed trial call opens the breaker again
+            time.sleep(0.06)
+            self.assertEqual(handler.breaker.state, "half-open")
+            self.assertRaises(requests.exceptions.ConnectionError, handler._send_request, url, "get")
+            self.assertEqual(handler.breaker.state, "open")
+
+        # An interrupted trial call is failed as well, it doesn't leave the breaker waiting for its outcome forever
+        time.sleep(0.06)
+        with patch.object(handler, '_send', side_effect=SystemExit(0)):
+            self.assertRaises(SystemExit, handler._send_request, url, "get")
+        self.assertEqual(handler.breaker.state, "open")
+
+        time.sleep(0.06)
+        with patch.object(handler, '_send', side_effect=get_privat_response):
+            handler._send_request(url, "get")
+        self.assertEqual(handler.breaker.state, "closed")
+        api.log_sink.flush()
+
+    def test_hedged_requests(self):
+        handler = cbr_api.Api()
+        for _ in range(10):
+            handler.latency.add(0.01)
+
+        def send(url, **kwds):
+            if url.startswith("http://www.cbr.ru"):
+                time.sleep(0.5)
+            return Mock(text=url)
+
+        started = time.monotonic()
+        with patch.object(handler, '_send', side_effect=send):
+            response = handler._send_request("http://www.cbr.ru/scripts/XML_daily.asp", "get")
+        # The mirror is requested when the primary URL is slower than usual
+        self.assertEqual(response.text, "https://www.cbr-xml-daily.ru/daily_utf8.xml")
+        self.assertLess(time.monotonic() - started, 0.5)
+        api.log_sink.flush()
+
+    def test_stale_while_revalidate(self):
+        client = app.test_client()
+        url = "http://localhost:5000/api/xrates/json"
+        args = {"from_currency": 840, "to_currency": 980}
+        saved = [(xrate.id, xrate.rate, xrate.updated) for xrate in models.XRate.select()]
+        now = models.peewee_datetime.datetime.now()
+        try:
+            for age, state, revalidations in ((60, "fresh", 0), (3 * 60 * 60, "stale", 1), (48 * 60 * 60, "expired", 2)):
+                (models.XRate.update(updated=now - models.peewee_datetime.timedelta(seconds=age))
+                 .where(models.XRate.from_currency == 840, models.XRate.to_currency == 980).execute())
+                models.bump_rates_version()
+                r = client.get(url, query_string=args)
+                self.assertEqual(r.json[0]["freshness"], state)
+                self.assertGreaterEqual(int(r.headers["X-Rates-Age"]), age)
+                # Outdated rates are served as they are and refreshed in the background
+                self.assertEqual(self.revalidate.call_count, revalidations)
+            self.revalidate.assert_called_with([(840, 980)])
+
+            # Rates older than max_age are refreshed before the response
+            with patch('api._fetch_rate', return_value=42.0) as fetch_rate:
+                r = client.get(url, query_string={**args, "max_age": 60 * 60})
+            fetch_rate.assert_called_once()
+            self.assertEqual((r.json[0]["rate"], r.json[0]["freshness"]), (42.0, "fresh"))
+
+            # max_age is bounded by the shortest refresh interval of the handler
+            with patch('api._fetch_rate', return_value=43.0) as fetch_rate:
+                r = client.get(url, query_string={**args, "max_age": 0})
+            fetch_rate.assert_not_called()
+            self.assertEqual(r.json[0]["rate"], 42.0)
+            for max_age in ("-1", "hour"):
+                r = client.get(url, query_string={**args, "max_age": max_age})
+                self.assertEqual(r.status_code, http.HTTPStatus.BAD_REQUEST)
+
+            # Concurrent refreshes of the same pair call the external API once
+            def fetch_rate(xrate):
+                time.sleep(0.1)
+                return 44.0
+
+            with patch('api._fetch_rate', side_effect=fetch_rate) as fetch_rate_mock, patch('api.save_rates'), \
+                    ThreadPoolExecutor(max_workers=3) as executor:
+                results = list(executor.map(lambda _: api.refresh([(840, 980)]), range(3)))
+            fetch_rate_mock.assert_called_once()
+            self.assertEqual(sorted(map(len, results)), [0, 0, 1])
+
+            # The rates without a handler are served by the default TTLs and never refreshed
+            models.XRate.create(from_currency=978, to_currency=840, rate=1.1, module="test_api",
+                                updated=now - models.peewee_datetime.timedelta(hours=3))
+            models.bump_rates_version()
+            for query_string in ({}, {"max_age": 0}):
+                with patch('api._fetch_rate', return_value=45.0):
+                    r = client.get(url, query_string=query_string)
+                self.assertEqual(r.status_code, http.HTTPStatus.OK)
+                test_rate = next(rate for rate in r.json if (rate["from"], rate["to"]) == (978, 840))
+                self.assertEqual((test_rate["rate"], test_rate["freshness"]), (1.1, "stale"))
+                self.assertNotIn((978, 840), self.revalidate.call_args.args[0])
+        finally:
+            models.XRate.delete().where(models.XRate.module == "test_api").execute()
+            for xrate_id, rate, updated in saved:
+                models.XRate.update(rate=rate, updated=updated).where(models.XRate.id == xrate_id).execute()
+            models.bump_rates_version()
+            api.registry.reload_routes()
+
+    def test_cbr_rates_index(self):
+        handler = cbr_api.Api()
+        content = """<?xml version="1.0" encoding="windows-1251"?>
+            <ValCurs Date="01.01.2020" name="Foreign Currency Market">
+                <Valute ID="R01235"><NumCode>840</NumCode><CharCode>USD</CharCode><Nominal>1</Nominal>
+                    <Name>Доллар США</Name><Value>61,9057</Value></Valute>
+                <Valute ID="R01820"><NumCode>392</NumCode><CharCode>JPY</CharCode><Nominal>100</Nominal>
+                    <Name>Японских иен</Name><Value>56,9800</Value></Valute>
+                <Valute ID="R01239"><NumCode>978</NumCode><CharCode>EUR</CharCode><Nominal>1</Nominal>
+                    <Name>Евро</Name><Value>69,3777</Value></Valute>
+            </ValCurs>""".encode("windows-1251")
+
+        # Values are per one unit, the parsing stops when all the requested currencies are found
+        self.assertEqual(handler._parse_rates(content, {840, 392}), {840: 61.9057, 392: 0.5698})
+        self.assertEqual(handler._parse_rates(content[:content.index(b"<Valute ID=\"R01239\"")], {840}), {840: 61.9057})
+
+        # The document is requested and parsed once for all the pairs of a refresh cycle
+        xrate = models.XRate(from_currency=840, to_currency=643, module="cbr_api")
+        with patch.object(handler, '_send', return_value=Mock(text="", content=content)) as send, \
+                patch.object(handler, '_parse_rates', wraps=handler._parse_rates) as parse_rates, api.refresh_cycle():
+            self.assertEqual([handler.fetch_rate(xrate) for _ in range(3)], [61.9057] * 3)
+            self.assertRaises(ValueError, handler.fetch_rate, models.XRate(from_currency=978, to_currency=643))
+        send.assert_called_once()
+        parse_rates.assert_called_once()
+        self.assertEqual(handler._parse_rates(content, None), {840: 61.9057, 392: 0.5698, 978: 69.3777})
+
+        # All the currencies of the document are parsed only when a full refresh creates the new pairs
+        cbr_rates = list(models.XRate.select().where(models.XRate.module == "cbr_api"))
+        saved = [(xrate.id, xrate.rate, xrate.updated) for xrate in cbr_rates]
+        cbr = api.registry.handler("cbr_api")
+        try:
+            with patch.object(cbr, '_send', return_value=Mock(text="", content=content)), \
+                    patch.object(api.registry, 'xrates', return_value=cbr_rates):
+                self.assertNotIn((392, 643), api.update_rates(create=False))
+                outcomes = api.update_rates(create=True)
+            self.assertIsNone(outcomes[(392, 643)])
+            self.assertEqual(api.registry.resolve(392, 643)[1].rate, 0.5698)
+        finally:
+            created = (models.XRate.module == "cbr_api") & models.XRate.id.not_in([xrate.id for xrate in cbr_rates])
+            models.XRate.delete().where(created).execute()
+            for xrate_id, rate, updated in saved:
+                models.XRate.update(rate=rate, updated=updated).where(models.XRate.id == xrate_id).execute()
+            models.bump_rates_version()
+            api.registry.reload_routes()
+        api.log_sink.flush()
+
+    def test_bulk_rates(self):
+        handler = api.registry.handler("privat_api")
+        response = [{"ccy": "USD", "base_ccy": "UAH", "sale": "30.0"}, {"ccy": "EUR", "base_ccy": "UAH", "sale": "33.0"},
+                    {"ccy": "BTC", "base_ccy": "USD", "sale": "9000.0"}, {"ccy": "XXX", "base_ccy": "UAH", "sale": "1"}]
+        self.assertTrue(handler.bulk)
+        self.assertFalse(api.registry.handler("coinmarketcap_api").bulk)
+
+        # All the pairs of the document come from one request, the unknown currencies are skipped
+        privat_response = Mock(text=json.dumps(response), json=lambda: response)
+        with patch.object(handler, '_send', return_value=privat_response) as send, api.refresh_cycle():
+            self.assertEqual(handler.fetch_rates(), {(840, 980): 30.0, (978, 980): 33.0, (1000, 840): 9000.0})
+            self.assertEqual(handler.fetch_rate(models.XRate(from_currency=1000, to_currency=840)), 9000.0)
+        send.assert_called_once()
+
+        # A refresh creates the new pairs from the same response, a partial one only when it is asked to
+        privat_rates = list(models.XRate.select().where(models.XRate.module == "privat_api"))
+        saved = [(xrate.id, xrate.rate, xrate.updated) for xrate in privat_rates]
+        new_pair = (models.XRate.from_currency == 978) & (models.XRate.to_currency == 980)
+        try:
+            with patch.object(handler, '_send', return_value=privat_response) as send:
+                self.assertNotIn((978, 980), api.update_rates(privat_rates))
+                with patch.object(api.registry, 'xrates', return_value=privat_rates):
+                    outcomes = api.update_rates(create=True)
+            self.assertEqual(send.call_count, 2)
+            self.assertIsNone(outcomes[(978, 980)])
+            self.assertEqual(api.registry.resolve(978, 980)[1].rate, 33.0)
+            self.assertEqual(api.registry.resolve(978, 980)[1].module, "privat_api")
+
+            # The scheduled refresh creates them as well if it is configured, the pairs which are not due are known
+            models.XRate.delete().where(new_pair).execute()
+            api.registry.reload_routes()
+            with patch.object(handler, '_send', return_value=privat_response), patch('api.AUTO_CREATE_RATES', True), \
+                    patch.object(api.schedule, 'due', return_value=privat_rates[:1]), patch.object(api.schedule, 'record'):
+                outcomes = api.update_due_rates()
+            self.assertIsNone(outcomes[(978, 980)])
+            self.assertEqual(api.registry.resolve(978, 980)[1].rate, 33.0)
+            self.assertEqual(models.XRate.select().where(models.XRate.module == "privat_api").count(),
+                             len(privat_rates) + 1)
+        finally:
+            models.XRate.delete().where(new_pair).execute()
+            for xrate_id, rate, updated in saved:
+                models.XRate.update(rate=rate, updated=updated).where(models.XRate.id == xrate_id).execute()
+            models.bump_rates_version()
+            api.registry.reload_routes()
+        api.log_sink.flush()
+
+    def test_async_refresh(self):
+        handler = api.registry.handler("cryptonator_api")
+        self.assertIsInstance(handler, api._AsyncApi)
+        calls, running, peak = [], 0, 0
+
+        async def send(url, method, data=None, headers=None):
+            nonlocal running, peak
+            calls.append(url)
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.1)
+            running -= 1
+            return Response(200, json.dumps({"ticker": {"price": "2.0"}}).encode())
+
+        async def fetch(xrates):
+            return await asyncio.gather(*(handler.fetch_rate_async(xrate) for xrate in xrates))
+
+        xrates = [models.XRate(from_currency=1000, to_currency=code, module="cryptonator_api") for code in (980, 643)]
+        with patch.object(handler, '_send_async', new=send):
+            # The requests of async handlers are sent by coroutines of one loop at the same time
+            self.assertEqual(api.event_loop.run(fetch(xrates)), [2.0, 2.0])
+            self.assertEqual(peak, 2)
+
+            # Sync code runs them on the loop, sharing the responses of its refresh cycle
+            with api.refresh_cycle():
+                self.assertEqual([handler.fetch_rate(xrates[0]) for _ in range(3)], [2.0] * 3)
+            self.assertEqual(len(calls), 3)
+
+            # Async and sync handlers are refreshed together, and all the rates are stored at once
+            privat_rates = list(models.XRate.select().where(models.XRate.module == "privat_api"))
+            with patch.object(api.registry.handler("privat_api"), '_send', side_effect=get_privat_response) as privat, \
+                    patch('api.save_rates') as save_rates:
+                outcomes = api.event_loop.run(api.update_rates_async(xrates + privat_rates))
+        privat.assert_called_once()
+        self.assertEqual([outcomes[(1000, 980)], outcomes[(1000, 643)], outcomes[(840, 980)]], [None] * 3)
+        self.assertIsInstance(outcomes[(1000, 840)], ValueError)
+        save_rates.assert_called_once()
+        self.assertEqual(len(save_rates.call_args.args[0]), 3)
+
+        async def session_limits():
+            session = api.async_sessions.session()
+            limits = session.connector.limit, session.connector.limit_per_host
+            await api.async_sessions.close()
+            return limits
+
+        self.assertEqual(api.event_loop.run(session_limits()), (config.ASYNC_HTTP_LIMIT, config.ASYNC_HTTP_LIMIT_PER_HOST))
+
+        # Connection errors and 429/5xx responses are retried with a backoff, like the sync session does
+        class FakeResponse:
+            def __init__(self, status):
+                self.status, self.charset = status, None
+
+            async def __aenter__(self):
+                if self.status is None:
+                    raise aiohttp.ClientConnectionError()
+                return self
+
+            async def __aexit__(self, *args):
+                return False
+
+            async def read(self):
+                return b"{}"
+
+        manager = AsyncSessionManager(retries=2, backoff_factor=0.01)
+        with patch.object(manager, 'session') as session:
+            session.return_value.request.side_effect = [FakeResponse(None), FakeResponse(503), FakeResponse(200)]
+            self.assertEqual(api.event_loop.run(manager.request("GET", "http://localhost")).status_code, 200)
+            session.return_value.request.side_effect = [FakeResponse(503)] * 3
+            self.assertEqual(api.event_loop.run(manager.request("GET", "http://localhost")).status_code, 503)
+            session.return_value.request.side_effect = [FakeResponse(None)] * 3
+            self.assertRaises(aiohttp.ClientError, api.event_loop.run, manager.request("GET", "http://localhost"))
+            self.assertEqual(session.return_value.request.call_count, 9)
+
+        async def wait_for_loop():
+            return api.event_loop.run(asyncio.sleep(0))
+
+        self.assertRaises(RuntimeError, api.event_loop.run, wait_for_loop())
+        api.log_sink.flush()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -36,6 +36,21 @@ def api_rates(fmt=None):
     return controllers.GetApiRates().call(fmt)
 
 
+@app.route("/api/xrates/stream")
+def api_rates_stream():
+    return controllers.StreamRates().call()
+
+
+@app.route("/api/xrates/history")
+def api_rates_history():
+    return controllers.GetRatesHistory().call()
+
+
+@app.route("/api/convert")
+def api_convert():
+    return controllers.ConvertCurrency().call()
+
+
 @app.route("/update/<int:from_currency>/<int:to_currency>")
 @app.route("/update/all")
 def update_xrates(from_currency=None, to_currency=None):
@@ -51,3 +66,8 @@ def edit_xrate(from_currency, to_currency):
 @app.route("/logs/<logs_type>/<fmt>")
 def view_logs(logs_type, fmt):
     return controllers.ViewLogs().call(logs_type, fmt)
+
+
+@app.route("/logs/<logs_type>/export/<fmt>")
+def export_logs(logs_type, fmt):
+    return controllers.ExportLogs().call(logs_type, fmt)